@@ -0,0 +1,198 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+import ml_api
+
+# 離線批次評估：不經 HTTP，直接以伺服器的處理函數 (臉部網格、表情預測、面積差異) 分析整個影像資料夾
+# 用法：
+#   python batch_eval.py 影像資料夾 [...] --model-label Model_1 --output results.csv
+#   python batch_eval.py raf-db/test --model-label Model_2 --output results.parquet --labels list_patition_label.txt
+# 若影像所在資料夾名稱為表情名稱或類別編號 (或以 --labels 指定標註檔)，會另外輸出混淆矩陣
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+RESULT_FIELDS = ['path', 'face_detected', 'predicted_class', 'emotion', 'confidence',
+                 'area_difference', 'normalized_difference', 'level', 'area_result', 'true_class']
+
+
+def find_images(directories):
+    paths = []
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+# 建立表情名稱/編號 -> 類別編號的對照 (例如 "happy" 或 "1" -> 1)
+def class_lookup(definitions):
+    lookup = {}
+    for exp in definitions.data['exp_to_au']:
+        lookup[str(exp.get('exp', '')).lower()] = int(exp['exp_num'])
+        lookup[str(exp['exp_num'])] = int(exp['exp_num'])
+    return lookup
+
+# 讀取標註檔，每行 "檔名 類別" (以空白或逗號分隔，類別可為名稱或編號)
+def read_label_file(path, lookup):
+    labels = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.replace(',', ' ').split()
+            if len(parts) >= 2 and parts[1].lower() in lookup:
+                labels[os.path.basename(parts[0])] = lookup[parts[1].lower()]
+    return labels
+
+def true_class_for(path, lookup, labels):
+    if os.path.basename(path) in labels:
+        return labels[os.path.basename(path)]
+    return lookup.get(os.path.basename(os.path.dirname(path)).lower())
+
+
+# 子行程初始化：每個行程使用單一執行緒的 TensorFlow/OpenCV，避免多個行程互相搶占 CPU
+_worker_label = None
+
+def init_worker(model_label):
+    global _worker_label
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    cv2.setNumThreads(1)
+    ml_api.load_model_by_label(model_label)
+    _worker_label = model_label
+
+# 分析一批影像：逐張偵測臉部網格，再將偵測到人臉的影像合併為一次表情預測
+def analyze_chunk(paths):
+    definitions = ml_api.muscle_definitions.get()
+
+    rows, inputs, faces = [], [], []
+    for path in paths:
+        row = {'path': path, 'face_detected': False}
+        rows.append(row)
+        try:
+            with open(path, 'rb') as f:
+                img, img_array = ml_api.decode_image(f.read())
+        except (OSError, ValueError, cv2.error) as e:
+            print(f"\n無法讀取影像 {path}: {e}")
+            continue
+        points = ml_api.detect_landmarks(img)
+        row['face_detected'] = points is not None
+        if points is not None:
+            inputs.append(img_array)
+            faces.append((row, points))
+
+    if inputs:
+        predictions = ml_api.load_model_by_label(_worker_label).predict(np.concatenate(inputs))
+        for (row, points), probabilities in zip(faces, predictions):
+            predicted_class = int(np.argmax(probabilities))
+            exp_info = definitions.expression(predicted_class)
+            _, _, area_result, level, area_difference, normalized_difference = ml_api.measure_area_difference(points, definitions)
+            row.update({
+                'predicted_class': predicted_class,
+                'emotion': exp_info.emotion if exp_info else '未知表情',
+                'confidence': round(float(probabilities[predicted_class]), 4),
+                'area_difference': area_difference,
+                'normalized_difference': normalized_difference,
+                'level': level,
+                'area_result': area_result,
+            })
+    return rows
+
+
+# 結果輸出：依副檔名寫入 CSV 或 Parquet (需安裝 pyarrow)，分批寫入不需保留全部結果
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith('.parquet')
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self._pa = pa
+            self._schema = pa.schema([
+                ('path', pa.string()), ('face_detected', pa.bool_()), ('predicted_class', pa.int64()),
+                ('emotion', pa.string()), ('confidence', pa.float64()), ('area_difference', pa.float64()),
+                ('normalized_difference', pa.float64()), ('level', pa.string()), ('area_result', pa.string()),
+                ('true_class', pa.int64()),
+            ])
+            self._writer = pq.ParquetWriter(path, self._schema)
+        else:
+            self._file = open(path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS)
+            self._writer.writeheader()
+
+    def write(self, rows):
+        if self.parquet:
+            columns = {field: [row.get(field) for row in rows] for field in RESULT_FIELDS}
+            self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+        else:
+            self._writer.writerows(rows)
+
+    def close(self):
+        if self.parquet:
+            self._writer.close()
+        else:
+            self._file.close()
+
+def write_confusion_matrix(path, matrix, class_names):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['true\\predicted'] + class_names)
+        for name, counts in zip(class_names, matrix):
+            writer.writerow([name] + counts.tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='離線批次評估影像資料夾')
+    parser.add_argument('directories', nargs='+', help='影像資料夾 (會遞迴搜尋子資料夾)')
+    parser.add_argument('--model-label', required=True, help='MODEL_PATHS 中的模型標籤')
+    parser.add_argument('--output', required=True, help='結果檔案 (.csv 或 .parquet)')
+    parser.add_argument('--labels', help='標註檔，每行 "檔名 類別"')
+    parser.add_argument('--confusion', help='混淆矩陣輸出檔，預設為結果檔名加上 _confusion.csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='行程數')
+    parser.add_argument('--chunk-size', type=int, default=16, help='每個行程一次處理的影像數')
+    args = parser.parse_args()
+
+    ml_api.model_registry.resolve(args.model_label)
+    definitions = ml_api.muscle_definitions.get()
+    lookup = class_lookup(definitions)
+    labels = read_label_file(args.labels, lookup) if args.labels else {}
+    class_count = max(lookup.values()) + 1
+    class_names = [definitions.expression(i).emotion if definitions.expression(i) else str(i) for i in range(class_count)]
+
+    paths = find_images(args.directories)
+    chunks = [paths[i:i + args.chunk_size] for i in range(0, len(paths), args.chunk_size)]
+    print(f"共 {len(paths)} 張影像，使用 {args.workers} 個行程")
+
+    writer = ResultWriter(args.output)
+    confusion = np.zeros((class_count, class_count), np.int64)
+    processed = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(args.model_label,)) as executor:
+            for rows in executor.map(analyze_chunk, chunks):
+                for row in rows:
+                    row['true_class'] = true_class_for(row['path'], lookup, labels)
+                    if row['true_class'] is not None and row.get('predicted_class') is not None:
+                        confusion[row['true_class'], row['predicted_class']] += 1
+                writer.write(rows)
+                processed += len(rows)
+                print(f"\r{processed}/{len(paths)} 張，{processed / (time.perf_counter() - start):.1f} 張/秒", end='', flush=True)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n完成：{processed} 張影像，{elapsed:.1f} 秒，{processed / elapsed if elapsed else 0:.1f} 張/秒")
+
+    if confusion.sum():
+        confusion_path = args.confusion or os.path.splitext(args.output)[0] + '_confusion.csv'
+        write_confusion_matrix(confusion_path, confusion, class_names)
+        print(f"準確率: {np.trace(confusion) / confusion.sum():.2%} ({confusion.sum()} 張有標註)，混淆矩陣: {confusion_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from ml_api import FaceMeshPool, create_face_mesh, create_tracking_face_mesh, landmarks_to_array
+
+# 量測 FaceMesh 池大小對臉部網格偵測吞吐量的影響
+# 用法：python bench_face_mesh.py face1.jpg face2.jpg --pool-sizes 1 2 4 8 --requests 200
+# 比較靜態影像模式與追蹤模式 (即時分析連線使用) 的逐影格延遲：
+#   python bench_face_mesh.py --tracking --video camera.mp4 --frames 300
+#   python bench_face_mesh.py --tracking face1.jpg --frames 300   (未指定影片時以測試影像小幅平移模擬連續影格)
+
+
+def load_images(paths):
+    images = [cv2.imread(p, cv2.IMREAD_COLOR) for p in paths]
+    missing = [p for p, img in zip(paths, images) if img is None]
+    if missing:
+        raise SystemExit(f"無法讀取影像: {', '.join(missing)}")
+    return images
+
+def bench_pool(images, pool_size, requests):
+    pool = FaceMeshPool(pool_size)
+    try:
+        with ThreadPoolExecutor(pool_size) as executor:
+            # 暖機：建立所有實例
+            list(executor.map(pool.process, images * pool_size))
+
+            latencies = []
+
+            def timed_process(img):
+                start = time.perf_counter()
+                results = pool.process(img)
+                latencies.append(time.perf_counter() - start)
+                return results.multi_face_landmarks is not None
+
+            start = time.perf_counter()
+            detected = list(executor.map(timed_process, [images[i % len(images)] for i in range(requests)]))
+            elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "pool_size": pool_size,
+        "throughput": requests / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "detected": sum(detected) / requests,
+    }
+
+
+def load_video_frames(path, count):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(frame)
+    capture.release()
+    if not frames:
+        raise SystemExit(f"無法讀取影片: {path}")
+    return frames
+
+# 將測試影像依序小幅平移，模擬攝像頭的連續影格
+def simulate_frames(images, count):
+    frames = []
+    for i in range(count):
+        img = images[i * len(images) // count]
+        shift = np.float32([[1, 0, 3 * np.sin(i / 5)], [0, 1, 2 * np.cos(i / 7)]])
+        frames.append(cv2.warpAffine(img, shift, (img.shape[1], img.shape[0]), borderMode=cv2.BORDER_REPLICATE))
+    return frames
+
+def bench_mode(factory, frames):
+    face_mesh = factory()
+    try:
+        face_mesh.process(frames[0])  # 暖機
+        latencies, landmarks = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            results = face_mesh.process(frame)
+            latencies.append(time.perf_counter() - start)
+            landmarks.append(landmarks_to_array(results.multi_face_landmarks[0]) if results.multi_face_landmarks else None)
+    finally:
+        face_mesh.close()
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(np.mean(latencies_ms)),
+        "detected": sum(lm is not None for lm in landmarks) / len(frames),
+        "landmarks": landmarks,
+    }
+
+def bench_tracking(frames):
+    static = bench_mode(create_face_mesh, frames)
+    tracking = bench_mode(create_tracking_face_mesh, frames)
+
+    print(f"{'模式':<10} {'p50(ms)':>10} {'p99(ms)':>10} {'平均(ms)':>10} {'偵測率':>8}")
+    for name, r in (("static", static), ("tracking", tracking)):
+        print(f"{name:<10} {r['p50_ms']:>10.1f} {r['p99_ms']:>10.1f} {r['mean_ms']:>10.1f} {r['detected']:>8.0%}")
+
+    # 兩種模式皆偵測到人臉的影格中，特徵點的平均差異 (正規化座標)
+    diffs = [np.mean(np.abs(a[:, :2] - b[:, :2])) for a, b in zip(static["landmarks"], tracking["landmarks"])
+             if a is not None and b is not None]
+    if diffs:
+        print(f"特徵點平均差異: {np.mean(diffs):.4f} (正規化座標)，追蹤模式加速 {static['mean_ms'] / tracking['mean_ms']:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FaceMesh 池大小與吞吐量測試')
+    parser.add_argument('images', nargs='*', help='含有人臉的測試影像')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 4, 8], help='要測試的池大小')
+    parser.add_argument('--requests', type=int, default=200, help='每種池大小的請求數')
+    parser.add_argument('--tracking', action='store_true', help='比較靜態影像模式與追蹤模式的逐影格延遲')
+    parser.add_argument('--video', help='追蹤模式比較使用的影片檔')
+    parser.add_argument('--frames', type=int, default=300, help='追蹤模式比較的影格數')
+    args = parser.parse_args()
+
+    if args.tracking:
+        if args.video:
+            frames = load_video_frames(args.video, args.frames)
+        elif args.images:
+            frames = simulate_frames(load_images(args.images), args.frames)
+        else:
+            parser.error('請指定 --video 或測試影像')
+        bench_tracking(frames)
+    else:
+        if not args.images:
+            parser.error('請指定測試影像')
+        images = load_images(args.images)
+        print(f"{'池大小':>6} {'張/秒':>10} {'p50(ms)':>10} {'p99(ms)':>10} {'偵測率':>8}")
+        for pool_size in args.pool_sizes:
+            r = bench_pool(images, pool_size, args.requests)
+            print(f"{r['pool_size']:>6} {r['throughput']:>10.1f} {r['p50_ms']:>10.1f} {r['p99_ms']:>10.1f} {r['detected']:>8.0%}")
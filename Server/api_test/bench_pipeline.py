@@ -0,0 +1,286 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+import ml_api
+
+# 分階段量測處理流程的耗時 (解碼、臉部網格、縮放、推論、肌肉標記、面積計算、翻轉、JPEG 編碼、Base64)
+# 使用小型替代模型與專案內附的臉部影像，不需要正式的 .keras 模型檔
+# 用法：
+#   python bench_pipeline.py --save baseline.json           量測並儲存基準
+#   python bench_pipeline.py --compare baseline.json        與基準比較，超過門檻時回傳非 0
+#   python bench_pipeline.py --image face.jpg --size 1080   使用指定影像並縮放為 1080x1080
+#   python bench_pipeline.py --faces 1 2 4                  量測多人臉流程的耗時隨臉部數的變化
+#   python bench_pipeline.py --memory                       量測各階段每次請求的記憶體配置峰值 (tracemalloc)
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DEFAULT_IMAGE = os.path.join(REPO_ROOT, 'Abstract-Image', '圖片a.png')
+DEFAULT_IMAGE_CROP = (190, 543, 783, 1137)  # 網頁實機畫面中的臉部區域 (上, 下, 左, 右)
+DEFAULT_DEFINITIONS = os.path.join(REPO_ROOT, '肌肉定位點', 'test.json')
+
+# 肌肉定義檔未包含臉頰面積部位時使用的預設部位 (臉部網格特徵點編號)
+DEFAULT_AREA_POINTS = {
+    'area_l': [117, 118, 101, 36, 203, 206, 216, 192, 213, 147, 123],
+    'area_r': [346, 347, 330, 266, 423, 426, 436, 416, 433, 376, 352],
+}
+
+
+# 與正式模型相同的輸入/輸出格式，但只有少量參數的替代模型
+# (CBAMLayer 的前一層與 Xception 輸出相同，縮小為 3x3 的特徵圖)
+def build_stub_model(class_count=7):
+    inputs = tf.keras.Input((ml_api.MODEL_INPUT_SIZE[1], ml_api.MODEL_INPUT_SIZE[0], 3))
+    x = tf.keras.layers.Conv2D(32, 3, strides=2, activation='relu')(inputs)
+    x = tf.keras.layers.Conv2D(64, 3, strides=2, activation='relu')(x)
+    x = tf.keras.layers.MaxPooling2D(8)(x)
+    x = ml_api.CBAMLayer()(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(class_count, activation='softmax')(x)
+    return ml_api.ResidentModel(tf.keras.Model(inputs, outputs))
+
+def load_definitions(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    for key, points in DEFAULT_AREA_POINTS.items():
+        data.setdefault(key, [{"no": i, "p": "1", "v": str(point)} for i, point in enumerate(points, 1)])
+    return ml_api.MuscleDefinitions(data, 1, None)
+
+def load_image(path, size):
+    img = cv2.imdecode(np.fromfile(path, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise SystemExit(f"無法讀取影像: {path}")
+    if path == DEFAULT_IMAGE:
+        top, bottom, left, right = DEFAULT_IMAGE_CROP
+        img = img[top:bottom, left:right]
+    if size:
+        img = cv2.resize(img, (size, size))
+    return np.ascontiguousarray(img)
+
+# 未偵測到人臉時 (例如合成影像)，以橢圓內的隨機點作為特徵點，使後續幾何階段仍可量測
+def synthetic_landmarks(seed=0):
+    rng = np.random.default_rng(seed)
+    angle = rng.uniform(0, 2 * np.pi, ml_api.NUM_FACE_LANDMARKS)
+    radius = np.sqrt(rng.uniform(0, 1, ml_api.NUM_FACE_LANDMARKS))
+    landmarks = np.zeros((ml_api.NUM_FACE_LANDMARKS, 3), np.float32)
+    landmarks[:, 0] = 0.5 + 0.3 * radius * np.cos(angle)
+    landmarks[:, 1] = 0.5 + 0.4 * radius * np.sin(angle)
+    return landmarks
+
+
+def time_stage(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    times *= 1000
+    return {
+        "median_ms": round(float(np.median(times)), 4),
+        "p90_ms": round(float(np.percentile(times, 90)), 4),
+        "mean_ms": round(float(np.mean(times)), 4),
+    }
+
+# 以 tracemalloc 量測每次呼叫的記憶體配置峰值 (KB，只包含 Python/NumPy 的配置，不含 TensorFlow 與 MediaPipe 內部記憶體)
+def memory_stage(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()  # 暖機 (建立執行緒重複使用的緩衝區)
+    peaks = np.empty(iterations)
+    tracemalloc.start()
+    try:
+        for i in range(iterations):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            fn()
+            peaks[i] = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return round(float(np.median(peaks)) / 1024, 1)
+
+def memory_profile(img, definitions, model, iterations):
+    encoded = cv2.imencode('.jpg', img)[1].tobytes()
+    frame, img_array = ml_api.decode_image(encoded)
+    print(f"工作解析度: {frame.shape[1]}x{frame.shape[0]} (一張影像 {frame.nbytes / 1024:.1f} KB)")
+    face_mesh = ml_api.create_face_mesh()
+    results = face_mesh.process(frame)
+    landmarks = ml_api.landmarks_to_array(results.multi_face_landmarks[0]) if results.multi_face_landmarks else synthetic_landmarks()
+    points = ml_api.landmark_pixels(landmarks, frame)
+    predicted_class = int(np.argmax(model.predict(img_array)))
+    timer = ml_api.StageTimer()
+
+    # render 會就地翻轉並繪製 frame，重複呼叫時每次處理的內容不同但配置相同
+    stages = {
+        "decode": lambda: ml_api.decode_image(encoded),
+        "face_mesh": lambda: face_mesh.process(frame),
+        "inference": lambda: model.predict(img_array),
+        "render_base64": lambda: ml_api.render_faces(frame, [(points, predicted_class)], 'base64', definitions, timer),
+        "vector": lambda: ml_api.face_vector_result(frame, points, predicted_class, definitions),
+    }
+    report = {}
+    with contextlib.redirect_stdout(io.StringIO()):  # 略過面積計算的輸出
+        for name, fn in stages.items():
+            report[name] = memory_stage(fn, iterations)
+    for name, peak in report.items():
+        print(f"{name:<28} {peak:>10.1f} KB")
+    face_mesh.close()
+    return report
+
+def run_benchmarks(img, definitions, model, iterations):
+    face_mesh = ml_api.create_face_mesh()
+    encoded = cv2.imencode('.jpg', img)[1].tobytes()
+    # 之後的階段以伺服器解碼後的工作解析度影像量測
+    img = ml_api.decode_image(encoded)[0]
+    print(f"工作解析度: {img.shape[1]}x{img.shape[0]}")
+
+    results = face_mesh.process(img)
+    if results.multi_face_landmarks:
+        landmarks = ml_api.landmarks_to_array(results.multi_face_landmarks[0])
+    else:
+        print("影像中未偵測到人臉，幾何階段改用合成特徵點")
+        landmarks = synthetic_landmarks()
+    points = ml_api.landmark_pixels(landmarks, img)
+
+    exp_info = definitions.expression(0)
+    # 只使用定義檔中存在的肌肉部位，避免每次呼叫都輸出找不到部位的訊息
+    mu_list = [mu for mu in (exp_info.mu_list if exp_info else []) if mu in definitions.geometry.offsets]
+    model_input = np.expand_dims(cv2.resize(img, ml_api.MODEL_INPUT_SIZE), axis=0)
+    canvas = img.copy()
+    jpeg = cv2.imencode('.jpg', img)[1]
+
+    stages = {
+        "decode": lambda: ml_api.decode_image(encoded),
+        "face_mesh": lambda: face_mesh.process(img),
+        "landmarks_to_array": lambda: ml_api.landmarks_to_array(results.multi_face_landmarks[0]) if results.multi_face_landmarks else None,
+        "landmark_pixels": lambda: ml_api.landmark_pixels(landmarks, img),
+        "resize": lambda: np.expand_dims(cv2.resize(img, ml_api.MODEL_INPUT_SIZE), axis=0),
+        "inference": lambda: model.predict(model_input),
+        "detect_face_landmarks": lambda: ml_api.detect_face_landmarks(canvas, points, mu_list, definitions),
+        "calculate_area_difference": lambda: ml_api.measure_area_difference(points, definitions),
+        "flip": lambda: cv2.flip(img, 1),
+        "jpeg_encode": lambda: cv2.imencode('.jpg', img),
+        "base64": lambda: base64.b64encode(jpeg).decode('utf-8'),
+    }
+
+    report = {}
+    for name, fn in stages.items():
+        report[name] = time_stage(fn, iterations)
+        print(f"{name:<28} {report[name]['median_ms']:>10.3f} ms (p90 {report[name]['p90_ms']:.3f} ms)")
+    face_mesh.close()
+    return report
+
+# 將影像排列為 count 張臉的格狀影像 (經伺服器解碼縮放至工作解析度)，量測多人臉流程各階段耗時，
+# 並列出每張臉的平均耗時，確認成本隨臉部數次線性成長
+def multi_face_bench(img, definitions, model, counts, iterations):
+    print(f"{'臉部數':>6} {'偵測到':>6} {'face_mesh':>10} {'crop':>8} {'inference':>10} {'render':>8} {'合計(ms)':>10} {'每張臉(ms)':>11}")
+    for count in counts:
+        columns = int(np.ceil(np.sqrt(count)))
+        rows = int(np.ceil(count / columns))
+        tiles = [img] * count + [np.zeros_like(img)] * (rows * columns - count)
+        grid = np.vstack([np.hstack(tiles[row * columns:(row + 1) * columns]) for row in range(rows)])
+        decoded = ml_api.decode_image(cv2.imencode('.jpg', grid)[1].tobytes())[0]
+
+        faces = ml_api.detect_all_landmarks(decoded, count)
+        if not faces:
+            print(f"{count:>6} 未偵測到人臉，略過")
+            continue
+        boxes = [ml_api.face_box(decoded, points) for points in faces]
+        crops = ml_api.face_crops(decoded, boxes)
+        predicted_classes = np.argmax(model.predict(crops), axis=1)
+        timer = ml_api.StageTimer()
+
+        stages = {
+            "face_mesh": lambda: ml_api.detect_all_landmarks(decoded, count),
+            "crop": lambda: ml_api.face_crops(decoded, boxes),
+            "inference": lambda: model.predict(crops),
+            "render": lambda: ml_api.multi_face_analysis(decoded, faces, predicted_classes, 'base64', definitions, timer),
+        }
+        with contextlib.redirect_stdout(io.StringIO()):  # 略過面積計算的輸出
+            medians = {name: time_stage(fn, iterations)["median_ms"] for name, fn in stages.items()}
+        total = sum(medians.values())
+        print(f"{count:>6} {len(faces):>6} {medians['face_mesh']:>10.2f} {medians['crop']:>8.2f} {medians['inference']:>10.2f} "
+              f"{medians['render']:>8.2f} {total:>10.2f} {total / len(faces):>11.2f}")
+    ml_api.multi_face_mesh_pool.close()
+
+# 與基準比較中位數，回傳超過倍數門檻且差距大於 min_delta_ms 的階段 (忽略極短階段的量測雜訊)
+def compare(report, baseline, threshold, min_delta_ms):
+    regressions = []
+    for key in ("width", "height", "iterations"):
+        if baseline["meta"].get(key) != report["meta"][key]:
+            print(f"注意：{key} 與基準不同 ({baseline['meta'].get(key)} -> {report['meta'][key]})")
+    print(f"\n{'階段':<28} {'基準(ms)':>10} {'目前(ms)':>10} {'比值':>8}")
+    for name, current in report["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+        before = baseline["stages"][name]["median_ms"]
+        ratio = current["median_ms"] / before if before else float('inf')
+        slower = ratio > threshold and current["median_ms"] - before > min_delta_ms
+        flag = "  <-- 變慢" if slower else ""
+        print(f"{name:<28} {before:>10.3f} {current['median_ms']:>10.3f} {ratio:>8.2f}{flag}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='處理流程分階段效能量測')
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='臉部影像，預設使用專案內附的網頁實機畫面')
+    parser.add_argument('--size', type=int, default=0, help='將影像縮放為 size x size (0 表示維持原尺寸)')
+    parser.add_argument('--definitions', default=DEFAULT_DEFINITIONS, help='肌肉定義檔')
+    parser.add_argument('--iterations', type=int, default=50, help='每個階段的量測次數')
+    parser.add_argument('--save', help='將結果儲存為 JSON 基準檔')
+    parser.add_argument('--compare', help='與 JSON 基準檔比較')
+    parser.add_argument('--threshold', type=float, default=1.2, help='中位數超過基準的倍數視為變慢')
+    parser.add_argument('--min-delta-ms', type=float, default=0.1, help='中位數差距小於此值 (ms) 時不視為變慢')
+    parser.add_argument('--faces', type=int, nargs='+', help='只量測多人臉流程，依序使用指定的臉部數')
+    parser.add_argument('--memory', action='store_true', help='只量測各階段的記憶體配置峰值')
+    args = parser.parse_args()
+
+    img = load_image(args.image, args.size)
+    definitions = load_definitions(args.definitions)
+    model = build_stub_model()
+    model.warmup()
+    if args.faces:
+        multi_face_bench(img, definitions, model, args.faces, args.iterations)
+        sys.exit(0)
+    if args.memory:
+        memory_profile(img, definitions, model, args.iterations)
+        sys.exit(0)
+
+    print(f"影像尺寸: {img.shape[1]}x{img.shape[0]}，每階段 {args.iterations} 次")
+    report = {
+        "meta": {
+            "image": os.path.basename(args.image),
+            "width": img.shape[1],
+            "height": img.shape[0],
+            "iterations": args.iterations,
+            "python": platform.python_version(),
+            "tensorflow": tf.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        "stages": run_benchmarks(img, definitions, model, args.iterations),
+    }
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        print(f"已儲存基準: {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"變慢的階段: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# 比較不同 CPU 執行緒配置下，同一主機執行多個伺服器行程時的總吞吐量與延遲分布 (p50/p99)
+# 每個行程以獨立的子行程執行 (TensorFlow 的執行緒數在初始化後無法變更)，各自以多個並行請求執行完整處理流程
+# (解碼、臉部網格、批次推論、繪製與編碼)，所有行程完成預熱後同時開始
+# 配置方式：
+#   unmanaged  不套用配置 (ML_API_THREAD_BUDGET=0)：TensorFlow、OpenCV 與各執行緒池皆依主機的全部核心建立執行緒
+#   all-cores  套用配置，但每個行程的核心預算皆為主機的全部核心 (未依行程數分配)
+#   split      將核心平均分給各行程 (ML_API_CPU_BUDGET)，不綁定 CPU
+#   pinned     同 split，並將各行程綁定於不重疊的 CPU (ML_API_CPUS)
+# 用法：
+#   python bench_thread_budget.py                                   1、2、4 個行程，比較四種配置
+#   python bench_thread_budget.py --processes 4 --concurrency 8 --requests 200
+#   python bench_thread_budget.py --model model.keras --report budget.json
+# 預設使用 bench_pipeline.py 的小型替代模型與專案內附的臉部影像
+
+MODES = ('unmanaged', 'all-cores', 'split', 'pinned')
+MODEL_LABEL = 'bench'
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+# 各行程的環境變數 (CPU 數少於行程數時，綁定的 CPU 會由多個行程共用)
+def allocation_env(mode, index, processes, cpus):
+    if mode == 'unmanaged':
+        return {'ML_API_THREAD_BUDGET': '0'}
+    if mode == 'all-cores':
+        return {'ML_API_CPU_BUDGET': str(len(cpus))}
+    share = max(1, len(cpus) // processes)
+    env = {'ML_API_CPU_BUDGET': str(share)}
+    if mode == 'pinned':
+        start = index * share % len(cpus)
+        env['ML_API_CPUS'] = ','.join(str(cpus[(start + i) % len(cpus)]) for i in range(share))
+    return env
+
+def prepare_inputs(directory, args):
+    import bench_pipeline
+
+    model_path = args.model
+    if not model_path:
+        model_path = os.path.join(directory, 'stub_model.keras')
+        bench_pipeline.build_stub_model().model.save(model_path)
+    definitions_path = os.path.join(directory, 'definitions.json')
+    with open(definitions_path, 'w', encoding='utf-8') as f:
+        json.dump(bench_pipeline.load_definitions(args.definitions).data, f, ensure_ascii=False)
+    image_path = os.path.join(directory, 'image.jpg')
+    cv2.imwrite(image_path, bench_pipeline.load_image(args.image, args.size))
+    return model_path, definitions_path, image_path
+
+
+# 子行程：載入模型並預熱後等待開始訊號，再以 concurrency 個並行請求送出 requests 個請求
+def run_worker(config):
+    import ml_api
+
+    ml_api.MODEL_PATHS.clear()
+    ml_api.MODEL_PATHS[MODEL_LABEL] = config['model']
+    ml_api.muscle_definitions = ml_api.MuscleDefinitionStore(config['definitions'], ml_api.MUSCLE_DEFINITION_CHECK_INTERVAL)
+    with open(config['image'], 'rb') as f:
+        contents = f.read()
+
+    async def main():
+        for _ in range(3):
+            await ml_api.run_pipeline(contents, MODEL_LABEL, config['response_mode'], ml_api.StageTimer())
+
+        open(config['ready'], 'w').close()
+        while not os.path.exists(config['go']):
+            await asyncio.sleep(0.005)
+
+        latencies = []
+        remaining = [config['requests']]
+
+        async def client():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = time.perf_counter()
+                await ml_api.run_pipeline(contents, MODEL_LABEL, config['response_mode'], ml_api.StageTimer())
+                latencies.append(time.perf_counter() - start)
+
+        started = time.time()
+        await asyncio.gather(*(client() for _ in range(config['concurrency'])))
+        finished = time.time()
+        await ml_api.inference_batcher.close()
+        return {"started": started, "finished": finished, "latencies": latencies,
+                "thread_budget": ml_api.thread_budget.describe()}
+
+    print(json.dumps(asyncio.run(main())))
+
+# 以指定配置同時執行 processes 個子行程，彙整所有請求的吞吐量與延遲
+def run_allocation(mode, processes, inputs, args, directory):
+    model_path, definitions_path, image_path = inputs
+    cpus = available_cpus()
+    go = os.path.join(directory, f'{mode}_{processes}_go')
+    workers = []
+    for index in range(processes):
+        config = {
+            "model": model_path, "definitions": definitions_path, "image": image_path,
+            "requests": args.requests, "concurrency": args.concurrency, "response_mode": args.response_mode,
+            "ready": os.path.join(directory, f'{mode}_{processes}_{index}_ready'), "go": go,
+        }
+        env = dict(os.environ, **allocation_env(mode, index, processes, cpus))
+        log = open(os.path.join(directory, f'{mode}_{processes}_{index}.log'), 'w+')
+        process = subprocess.Popen([sys.executable, __file__, '--worker', json.dumps(config)],
+                                   env=env, stdout=subprocess.PIPE, stderr=log, text=True)
+        workers.append((process, log, config))
+
+    # 所有行程完成載入與預熱後才同時開始，避免載入時間影響量測
+    while not all(os.path.exists(config['ready']) for _, _, config in workers):
+        if any(process.poll() is not None for process, _, _ in workers):
+            break
+        time.sleep(0.05)
+    open(go, 'w').close()
+
+    results = []
+    for process, log, _ in workers:
+        output, _ = process.communicate()
+        if process.returncode != 0:
+            log.seek(0)
+            raise SystemExit(f"子行程失敗 ({mode}, {processes} 個行程):\n{log.read()[-2000:]}")
+        log.close()
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    latencies = np.array([latency for result in results for latency in result['latencies']]) * 1000
+    elapsed = max(r['finished'] for r in results) - min(r['started'] for r in results)
+    return {
+        "mode": mode,
+        "processes": processes,
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "max_ms": round(float(latencies.max()), 2),
+        "thread_budgets": [r['thread_budget'] for r in results],
+    }
+
+def print_row(row):
+    budget = row['thread_budgets'][0]
+    threads = f"{budget['inference_threads']}/{budget['mediapipe_workers']}/{budget['image_workers']}"
+    cpus = ','.join(str(cpu) for cpu in budget['cpus']) if budget['cpus'] else '-'
+    print(f"{row['processes']:>6} {row['mode']:<10} {threads:>10} {cpus:>8} {row['throughput']:>12.2f} "
+          f"{row['p50_ms']:>10.1f} {row['p99_ms']:>10.1f} {row['max_ms']:>10.1f}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--worker':
+        run_worker(json.loads(sys.argv[2]))
+        sys.exit(0)
+
+    from bench_pipeline import DEFAULT_DEFINITIONS, DEFAULT_IMAGE
+
+    parser = argparse.ArgumentParser(description='比較不同 CPU 執行緒配置的吞吐量與延遲')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help='同時執行的伺服器行程數')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES), help='比較的配置方式')
+    parser.add_argument('--concurrency', type=int, default=4, help='每個行程的並行請求數')
+    parser.add_argument('--requests', type=int, default=100, help='每個行程的請求數')
+    parser.add_argument('--response-mode', default='base64', choices=['base64', 'vector'], help='回應格式')
+    parser.add_argument('--model', help='模型檔 (.keras 或 .tflite)，預設使用小型替代模型')
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='臉部影像，預設使用專案內附的網頁實機畫面')
+    parser.add_argument('--size', type=int, default=0, help='將影像縮放為 size x size (0 表示維持原尺寸)')
+    parser.add_argument('--definitions', default=DEFAULT_DEFINITIONS, help='肌肉定義檔')
+    parser.add_argument('--report', help='將結果儲存為 JSON')
+    args = parser.parse_args()
+
+    print(f"可用 CPU: {len(available_cpus())}，每個行程 {args.requests} 個請求，並行 {args.concurrency}")
+    print(f"{'行程數':>6} {'配置':<10} {'推論/網格/影像':>10} {'綁定CPU':>8} {'吞吐量(次/秒)':>12} "
+          f"{'p50(ms)':>10} {'p99(ms)':>10} {'最大(ms)':>10}")
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        inputs = prepare_inputs(directory, args)
+        for processes in args.processes:
+            for mode in args.modes:
+                rows.append(run_allocation(mode, processes, inputs, args, directory))
+                print_row(rows[-1])
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,119 @@
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Add, Concatenate, Lambda, Multiply, Reshape
+
+from ml_api import (CBAMLayer, CUSTOM_OBJECTS, MODEL_INPUT_SIZE, MODEL_PATHS, OFFLINE_ARCHITECTURE_FILE,
+                    OFFLINE_WEIGHTS_FILE, ResidentModel, is_offline_model, is_tflite_model, load_model_file)
+
+# 比對追蹤後的推論函數與原本 model.predict 流程的輸出是否一致，並比較單張影像推論延遲
+# 用法：
+#   python check_inference.py [--images 影像資料夾] [--label Model_1]    檢查 MODEL_PATHS 中的模型
+#   python check_inference.py model.keras [...]                          檢查指定的模型檔 (或離線模型目錄)
+#   python check_inference.py --stub                                     以 bench_pipeline.py 的小型替代模型檢查，不需要正式模型檔
+
+
+# 原本的 CBAMLayer 實作 (每次呼叫建立新的層)，作為比對基準
+class LegacyCBAMLayer(CBAMLayer):
+    def call(self, inputs):
+        channel_avg_pool = self.channel_avg_pool(inputs)
+        channel_max_pool = self.channel_max_pool(inputs)
+        channel_avg_pool = Reshape((1, 1, -1))(channel_avg_pool)
+        channel_max_pool = Reshape((1, 1, -1))(channel_max_pool)
+        channel_avg_pool = self.channel_dense_1(channel_avg_pool)
+        channel_max_pool = self.channel_dense_1(channel_max_pool)
+        channel_avg_pool = self.channel_dense_2(channel_avg_pool)
+        channel_max_pool = self.channel_dense_2(channel_max_pool)
+        channel_attention = Add()([channel_avg_pool, channel_max_pool])
+        channel_attention = Multiply()([inputs, channel_attention])
+
+        avg_pool = Lambda(lambda x: tf.reduce_mean(x, axis=-1, keepdims=True))(channel_attention)
+        max_pool = Lambda(lambda x: tf.reduce_max(x, axis=-1, keepdims=True))(channel_attention)
+        concat = Concatenate(axis=-1)([avg_pool, max_pool])
+        spatial_attention = self.spatial_conv(concat)
+        return Multiply()([channel_attention, spatial_attention])
+
+# Keras 載入權重時依類別名稱對應子層，須與原本的類別同名
+LegacyCBAMLayer.__name__ = CBAMLayer.__name__
+
+def load_legacy_model(path):
+    custom_objects = dict(CUSTOM_OBJECTS, CBAMLayer=LegacyCBAMLayer)
+    if is_offline_model(path):
+        with open(os.path.join(path, OFFLINE_ARCHITECTURE_FILE), 'r', encoding='utf-8') as f:
+            model = tf.keras.models.model_from_json(f.read(), custom_objects=custom_objects)
+        model.load_weights(os.path.join(path, OFFLINE_WEIGHTS_FILE))
+        return model
+    return tf.keras.models.load_model(path, custom_objects=custom_objects)
+
+# 讀取測試影像 (縮放為模型輸入尺寸)，未指定資料夾時使用隨機影像
+def load_images(image_dir, count):
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.png')))[:count]
+        images = [cv2.resize(cv2.imread(p, cv2.IMREAD_COLOR), MODEL_INPUT_SIZE) for p in paths]
+        return np.stack(images)
+    return np.random.default_rng(0).integers(0, 256, (count, MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3), dtype=np.uint8)
+
+def median_latency(fn, runs):
+    fn()  # 暖機
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+def check(path, images, runs, tolerance):
+    legacy = load_legacy_model(path)
+    resident = ResidentModel(load_model_file(path))
+
+    # 原流程：float64 正規化後逐張 model.predict
+    expected = np.concatenate([legacy.predict(np.expand_dims(img, axis=0) / 255.0, verbose=0) for img in images])
+    actual = np.concatenate([resident.predict(np.expand_dims(img, axis=0)) for img in images])
+
+    max_diff = float(np.max(np.abs(expected - actual)))
+    agreement = float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+
+    single = np.expand_dims(images[0], axis=0)
+    legacy_ms = median_latency(lambda: legacy.predict(single / 255.0, verbose=0), runs)
+    traced_ms = median_latency(lambda: resident.predict(single), runs)
+
+    print(f"{path}")
+    print(f"  最大機率差異: {max_diff:.2e}  類別一致率: {agreement:.2%}")
+    print(f"  單張延遲 model.predict: {legacy_ms:.1f} ms  追蹤推論函數: {traced_ms:.1f} ms  ({legacy_ms / traced_ms:.1f}x)")
+    return max_diff <= tolerance and agreement == 1.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='比對推論函數與 model.predict 的輸出及延遲')
+    parser.add_argument('paths', nargs='*', help='要檢查的模型檔，預設為 MODEL_PATHS 中的模型')
+    parser.add_argument('--stub', action='store_true', help='以含 CBAMLayer 的小型替代模型檢查')
+    parser.add_argument('--label', help='只檢查指定的模型標籤，預設檢查 MODEL_PATHS 中的所有模型')
+    parser.add_argument('--images', help='測試影像資料夾，未指定時使用隨機影像')
+    parser.add_argument('--count', type=int, default=16, help='測試影像數量')
+    parser.add_argument('--runs', type=int, default=50, help='延遲量測次數')
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='允許的最大機率差異')
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.count)
+    if args.stub:
+        from bench_pipeline import build_stub_model
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stub_model.keras')
+            build_stub_model().model.save(path)
+            passed = check(path, images, args.runs, args.tolerance)
+    else:
+        labels = [args.label] if args.label else list(MODEL_PATHS)
+        paths = args.paths or [MODEL_PATHS[label] for label in labels]
+        # .tflite 模型的輸出比對由 convert_tflite.py 進行
+        paths = sorted({os.path.realpath(path) for path in paths if not is_tflite_model(path)})
+        passed = all([check(path, images, args.runs, args.tolerance) for path in paths])
+    print("一致" if passed else "不一致")
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from check_inference import load_images, median_latency
+from ml_api import MODEL_INPUT_SIZE, MODEL_PATHS, ResidentModel, TFLiteModel, is_tflite_model, load_model_file
+
+# 將 .keras 模型 (或離線模型目錄) 轉換為 TFLite 模型：float16 與以校正影像量化的 int8，
+# 並與原本的 Keras 推論比對輸出 (最大機率差異、類別一致率) 及延遲
+# 轉換後的 .tflite 可直接設定於 MODEL_PATHS，伺服器即改以 TFLite 直譯器 (XNNPACK) 推論該模型標籤
+# 用法：
+#   python convert_tflite.py --calibration 臉部影像資料夾             轉換 MODEL_PATHS 中所有模型 (相同檔案只轉換一次)
+#   python convert_tflite.py model.keras --variants int8 --calibration 臉部影像資料夾 --images 測試影像資料夾
+#   python convert_tflite.py --report-only --images 測試影像資料夾     只比對已轉換的模型
+# int8 須以實際的臉部影像校正數值範圍，未指定 --calibration 時使用隨機影像 (只適合確認轉換流程)
+
+VARIANTS = ('float16', 'int8')
+
+
+# 轉換後的模型預設放在原模型旁，例如 model.keras -> model_int8.tflite
+def tflite_path_for(path, variant):
+    return os.path.splitext(path.rstrip(os.sep))[0] + f'_{variant}.tflite'
+
+# 固定批次 1 的推論函數 (輸入 uint8 影像，正規化在圖中完成，與 ResidentModel 相同)
+def single_image_fn(model):
+    @tf.function(input_signature=[tf.TensorSpec((1, MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3), tf.uint8)])
+    def infer(images):
+        return model(tf.cast(images, tf.float32) / 255.0, training=False)
+    return infer.get_concrete_function()
+
+def convert(model, variant, calibration):
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([single_image_fn(model)], model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # 以校正影像估計各層的數值範圍，權重與運算量化為 int8 (沒有 int8 實作的運算保留 float)
+        converter.representative_dataset = lambda: ([calibration[i:i + 1]] for i in range(len(calibration)))
+    return converter.convert()
+
+
+# 與 Keras 推論比對輸出，並量測單張延遲與批次推論的每張耗時
+def compare(name, size, reference, candidate, images, runs, batch_size):
+    expected = reference.predict(images)
+    actual = candidate.predict(images)
+    batch = images[:batch_size]
+    return {
+        "variant": name,
+        "size_mb": round(size / 1024 / 1024, 1),
+        "max_diff": float(np.max(np.abs(expected - actual))),
+        "agreement": float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1))),
+        "single_ms": round(median_latency(lambda: candidate.predict(images[:1]), runs), 2),
+        "batch_ms_per_image": round(median_latency(lambda: candidate.predict(batch), max(runs // len(batch), 3)) / len(batch), 2),
+    }
+
+def print_report(path, rows, batch_size):
+    print(f"\n{path}")
+    print(f"{'格式':<10} {'大小(MB)':>10} {'最大機率差異':>14} {'類別一致率':>10} {'單張(ms)':>10} {f'批次{batch_size}每張(ms)':>16}")
+    for row in rows:
+        print(f"{row['variant']:<10} {row['size_mb']:>10.1f} {row['max_diff']:>14.2e} {row['agreement']:>10.2%} "
+              f"{row['single_ms']:>10.2f} {row['batch_ms_per_image']:>16.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='轉換 TFLite 模型並比對輸出及延遲')
+    parser.add_argument('paths', nargs='*', help='要轉換的模型檔，預設為 MODEL_PATHS 中的所有 Keras 模型')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS), help='轉換格式')
+    parser.add_argument('--calibration', help='int8 校正用的臉部影像資料夾，未指定時使用隨機影像')
+    parser.add_argument('--calibration-count', type=int, default=100, help='校正影像數量')
+    parser.add_argument('--images', help='比對用的測試影像資料夾，預設與校正影像相同')
+    parser.add_argument('--count', type=int, default=64, help='比對影像數量')
+    parser.add_argument('--runs', type=int, default=50, help='延遲量測次數')
+    parser.add_argument('--batch-size', type=int, default=16, help='批次延遲量測的批次大小')
+    parser.add_argument('--min-agreement', type=float, default=0.98, help='類別一致率低於此值時回傳非 0')
+    parser.add_argument('--report-only', action='store_true', help='不轉換，只比對已存在的 .tflite 模型')
+    parser.add_argument('--report', help='將比對結果儲存為 JSON')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted({os.path.realpath(p) for p in MODEL_PATHS.values() if not is_tflite_model(p)})
+    if not args.calibration and 'int8' in args.variants and not args.report_only:
+        print("注意：未指定 --calibration，int8 模型以隨機影像校正")
+    calibration = load_images(args.calibration, args.calibration_count)
+    images = load_images(args.images or args.calibration, args.count)
+
+    report = {}
+    passed = True
+    for path in paths:
+        model = load_model_file(path)
+        reference = ResidentModel(model)
+        reference.warmup()
+        rows = [compare("keras", reference.size, reference, reference, images, args.runs, args.batch_size)]
+        for variant in args.variants:
+            output = tflite_path_for(path, variant)
+            if not args.report_only:
+                with open(output, 'wb') as f:
+                    f.write(convert(model, variant, calibration))
+                print(f"已轉換 {path} -> {output}")
+            elif not os.path.exists(output):
+                print(f"{output} 不存在，略過")
+                continue
+            rows.append(compare(variant, os.path.getsize(output), reference, TFLiteModel(output), images, args.runs, args.batch_size))
+            passed = passed and rows[-1]["agreement"] >= args.min_agreement
+        print_report(path, rows, args.batch_size)
+        report[path] = rows
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+    sys.exit(0 if passed else 1)
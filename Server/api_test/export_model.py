@@ -0,0 +1,90 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import psutil
+
+from ml_api import MODEL_PATHS, OFFLINE_ARCHITECTURE_FILE, OFFLINE_WEIGHTS_FILE, is_tflite_model, load_model_file
+
+# 將 .keras 模型匯出為離線模型目錄 (架構 JSON + HDF5 權重)
+# 用法：
+#   python export_model.py                 匯出 MODEL_PATHS 中所有模型 (相同檔案只匯出一次)
+#   python export_model.py --benchmark     比較 .keras 與離線模型的載入時間及峰值記憶體
+
+
+# 離線模型目錄預設放在原模型旁，例如 model.keras -> model_offline
+def offline_dir_for(path):
+    return os.path.splitext(path)[0] + '_offline'
+
+# 將架構中所有 XceptionLayer 設為 weights=None，載入時不再建立 ImageNet 權重
+def strip_pretrained_weights(config):
+    if isinstance(config, dict):
+        if config.get('class_name') == 'XceptionLayer':
+            config['config']['weights'] = None
+        for value in config.values():
+            strip_pretrained_weights(value)
+    elif isinstance(config, list):
+        for value in config:
+            strip_pretrained_weights(value)
+    return config
+
+def export_model(path, output_dir):
+    model = load_model_file(path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    architecture = strip_pretrained_weights(json.loads(model.to_json()))
+    with open(os.path.join(output_dir, OFFLINE_ARCHITECTURE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(architecture, f)
+    model.save_weights(os.path.join(output_dir, OFFLINE_WEIGHTS_FILE), save_format='h5')
+
+    # 確認離線模型輸出與原模型一致
+    exported = load_model_file(output_dir)
+    sample = np.random.default_rng(0).random((4, 100, 100, 3)).astype(np.float32)
+    diff = np.max(np.abs(model.predict(sample, verbose=0) - exported.predict(sample, verbose=0)))
+    print(f"已匯出 {path} -> {output_dir} (輸出最大差異: {diff:.2e})")
+
+
+# 在獨立的子行程中載入模型，量測載入時間與峰值記憶體 (RSS)
+# (子行程匯入本模組時已完成 TensorFlow 等套件的初始化，不計入載入時間)
+def _measure_load(path):
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start = time.perf_counter()
+    load_model_file(path)
+    elapsed = time.perf_counter() - start
+    rss_after = process.memory_info().rss
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux 上單位為 KB
+    return elapsed, rss_before / 1024 / 1024, rss_after / 1024 / 1024, rss_peak / 1024 / 1024
+
+def measure_load(path):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_measure_load, path).result()
+
+def benchmark(paths):
+    print(f"{'模型':<40} {'載入秒數':>10} {'載入前RSS(MB)':>14} {'載入後RSS(MB)':>14} {'峰值RSS(MB)':>12}")
+    for path in paths:
+        for candidate in (path, offline_dir_for(path)):
+            if not os.path.exists(candidate):
+                print(f"{candidate:<40} 不存在，略過")
+                continue
+            elapsed, rss_before, rss_after, rss_peak = measure_load(candidate)
+            print(f"{candidate:<40} {elapsed:>10.2f} {rss_before:>14.0f} {rss_after:>14.0f} {rss_peak:>12.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='匯出離線模型並比較載入效能')
+    parser.add_argument('paths', nargs='*', help='要匯出的模型檔，預設為 MODEL_PATHS 中的所有模型')
+    parser.add_argument('--benchmark', action='store_true', help='只量測載入時間與峰值記憶體，不匯出')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted({os.path.realpath(p) for p in MODEL_PATHS.values() if not is_tflite_model(p)})
+    if args.benchmark:
+        benchmark(paths)
+    else:
+        for path in paths:
+            export_model(path, offline_dir_for(path))
@@ -1,20 +1,35 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, Response, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import cv2
 import mediapipe as mp
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.applications import Xception
-from tensorflow.keras.layers import Layer, GlobalAveragePooling2D, Dense, Dropout, Input, Multiply, Reshape, MaxPooling2D, Conv2D, Add, Activation, Concatenate, Lambda
+from tensorflow.keras.layers import Layer, GlobalAveragePooling2D, Dense, Dropout, Input, MaxPooling2D, Conv2D, Activation
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.regularizers import l2
 from tensorflow.keras.preprocessing import image
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.websockets import WebSocketState
 from fastapi import FastAPI, UploadFile, File
 import base64
+import io
 import random
+import hashlib
+import secrets
 import json
+import os
+import time
+import asyncio
+import queue
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+from prometheus_client import Counter as MetricCounter
+from PIL import Image
 
 #ngrok重啟時請先"ctrl+f"選取下列網址，並點選"全部取代"為新網址
 ngrok = 'https://8638-210-59-96-137.ngrok-free.app'
@@ -22,6 +37,8 @@ ngrok = 'https://8638-210-59-96-137.ngrok-free.app'
 # 载入定義的肌肉檔案
 # 指定json檔路徑
 json_path = '/home/wei-jie/test.json'
+# 檢查肌肉定義檔是否變更的間隔 (秒)，檔案變更後自動重新載入
+MUSCLE_DEFINITION_CHECK_INTERVAL = 1.0
 
 # 载入模型
 # 指定模型路徑
@@ -30,21 +47,173 @@ MODEL_PATHS = {
     "Model_2": "/home/wei-jie/model.keras",
     "Model_3": "/home/wei-jie/model.keras",
 }
+# 可改為指向 export_model.py 匯出的離線模型目錄 (例如 "/home/wei-jie/model_offline")，
+# 離線模型載入時不需網路，也不會建立 ImageNet 預訓練權重；
+# 或指向 convert_tflite.py 轉換的 .tflite 模型 (例如 "/home/wei-jie/model_int8.tflite")，改以 TFLite 直譯器 (XNNPACK) 推論
+
+# 模型常駐設定
+# 伺服器啟動時預先載入 MODEL_PATHS 中的模型，之後的請求直接使用記憶體中的模型
+PRELOAD_MODELS = True
+# 常駐模型的記憶體預算 (MB)，超過時淘汰最久未使用的模型
+MODEL_MEMORY_BUDGET_MB = 2048
+
+# 推論批次設定
+# 同一模型標籤的並行請求合併為一個批次推論，批次達上限或等待超過時間即送出
+INFERENCE_MAX_BATCH_SIZE = 16
+INFERENCE_MAX_WAIT_MS = 5
+
+# 即時分析 (WebSocket) 的臉部網格追蹤設定
+# 每個攝像頭連線使用專屬的追蹤模式 FaceMesh (static_image_mode=False)，沿用前一影格的特徵點而不需每張重新偵測人臉；
+# 閒置超過 TTL 秒或連線結束時釋放，超過上限數量的連線改用一般的靜態影像模式
+TRACKING_FACE_MESH_MAX = 8
+TRACKING_FACE_MESH_TTL = 30
+
+# 即時分析的影格變化偵測設定
+# 特徵點平均位移 (以兩眼外眼角距離正規化) 低於門檻時沿用前一次的表情、肌肉與面積結果，不重新推論與繪製；
+# 沿用的結果超過最長保留秒數後仍會重新分析
+CHANGE_THRESHOLD = 0.02
+CHANGE_MAX_AGE = 1.0
+
+# 多人臉分析設定 (表單欄位 max_faces)
+# max_faces 大於 1 時以多人臉的 FaceMesh 偵測最多 max_faces 張臉，各臉部裁切後合併為一個批次推論，
+# 回應中的 faces 列表包含每張臉的表情、肌肉與面積結果；max_faces 為 1 (預設) 時維持原本的單人臉流程與回應
+MAX_FACES_LIMIT = 10
+FACE_CROP_MARGIN = 0.25  # 臉部裁切框相對於特徵點範圍的外擴比例
+
+# CPU 執行緒配置
+# TensorFlow、TFLite 與 OpenCV 預設皆依主機的全部核心數建立執行緒，同一主機執行多個伺服器行程時會嚴重超額使用 CPU；
+# 啟動時依此行程的核心預算分配給推論與各執行緒池 (以環境變數設定，每個行程可各自指定)，並可將行程綁定於指定的 CPU
+# ML_API_CPUS：綁定的 CPU 編號 (例如 "0-3" 或 "0,2,4,6")，未設定時不綁定
+# ML_API_CPU_BUDGET：此行程使用的核心數，未設定時為可使用的 CPU 數 (綁定時為綁定的 CPU 數)
+# ML_API_INFERENCE_THREADS、ML_API_MEDIAPIPE_WORKERS、ML_API_IMAGE_WORKERS：覆寫依核心預算計算的分配
+# ML_API_THREAD_BUDGET=0：不套用配置，各執行環境與執行緒池使用原本的預設執行緒數 (用於比較)
+THREAD_BUDGET_ENABLED = os.environ.get('ML_API_THREAD_BUDGET', '1') != '0'
+CPU_AFFINITY = os.environ.get('ML_API_CPUS', '')
+CPU_BUDGET = int(os.environ.get('ML_API_CPU_BUDGET', '0'))
+INFERENCE_THREADS = int(os.environ.get('ML_API_INFERENCE_THREADS', '0'))  # TensorFlow intra-op 與 TFLite 執行緒數
+MEDIAPIPE_WORKERS = int(os.environ.get('ML_API_MEDIAPIPE_WORKERS', '0'))  # FaceMesh 池大小與執行緒數 (每個執行緒對應一個實例)
+IMAGE_WORKERS = int(os.environ.get('ML_API_IMAGE_WORKERS', '0'))  # OpenCV 解碼、繪圖與編碼的執行緒數
+INFERENCE_WORKERS = 1  # 每個模型標籤的推論已由批次排程合併
+
+# 上傳影像大小限制
+# 超過上傳大小的請求在接收過程中即回傳 413；解碼時依影像標頭的尺寸以縮小模式解碼，
+# 之後整個處理流程 (臉部網格、繪圖、編碼) 皆在長邊不超過 WORKING_MAX_SIDE 的工作解析度下進行
+MAX_UPLOAD_MB = 10
+MAX_IMAGE_PIXELS = 50_000_000  # 解碼前依標頭拒絕的像素數上限
+WORKING_MAX_SIDE = 1024
+
+# 回應模式 (表單欄位 response_mode)
+# base64：結果圖像以 base64 字串嵌入 JSON (預設，與舊版網頁相容)
+# url：結果圖像暫存於伺服器記憶體，JSON 只回傳 GET /images/{id} 網址，由網頁直接以二進位下載
+# vector：不繪製也不編碼圖像，只回傳肌肉與左右面積部位的多邊形座標及顏色，由網頁自行繪製於畫面上
+RESPONSE_MODES = ("base64", "url", "vector")
+IMAGE_STORE_TTL = 60  # 暫存圖像保留秒數
+IMAGE_STORE_MAX_MB = 128  # 暫存圖像總大小上限，超過時先淘汰最舊的圖像
+
+# 上傳影像的分析結果快取 (以影像內容 SHA-256、模型標籤、回應模式與肌肉定義版本為鍵)
+# 重送相同的影像時直接回傳結果，同時送達的相同請求共用一次運算
+RESULT_CACHE_MAX_MB = 64
+
+# 解析 CPU 編號列表 (例如 "0-3,8" -> {0, 1, 2, 3, 8})
+def parse_cpu_list(text):
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+# 核心預算分配
+# 推論 (TensorFlow intra-op / TFLite) 使用一半的核心，其餘核心分給 FaceMesh (較多的一半) 與 OpenCV 執行緒池，合計等於核心預算；
+# 每項至少 1 個執行緒，因此核心預算少於 3 時合計會超過預算 (三者依序處理同一請求，不會同時滿載)
+# TensorFlow inter-op 固定為 1 (批次由單一工作執行緒依序推論)，OpenCV 內部不再平行化 (並行由執行緒池提供)
+# MediaPipe 圖內部的執行緒數無法由 Python 設定，只能以綁定 CPU 限制
+class ThreadBudget:
+    def __init__(self, cores, cpus=None, inference_threads=0, mediapipe_workers=0, image_workers=0):
+        self.managed = True
+        self.cores = max(1, cores)
+        self.cpus = sorted(cpus) if cpus else None
+        self.inference_threads = inference_threads or max(1, self.cores // 2)
+        remaining = self.cores - self.inference_threads
+        self.mediapipe_workers = mediapipe_workers or max(1, (remaining + 1) // 2)
+        self.image_workers = image_workers or max(1, remaining - self.mediapipe_workers)
+        self.inter_op_threads = 1
+        self.opencv_threads = 1
+
+    # 不套用配置：TensorFlow 與 OpenCV 使用各自的預設執行緒數，執行緒池維持原本的大小
+    @classmethod
+    def unmanaged(cls):
+        cores = os.cpu_count() or 1
+        budget = cls(cores, inference_threads=cores, mediapipe_workers=cores, image_workers=4)
+        budget.managed = False
+        budget.inter_op_threads = budget.opencv_threads = None  # 執行環境的預設值
+        return budget
+
+    @classmethod
+    def from_settings(cls):
+        if not THREAD_BUDGET_ENABLED:
+            return cls.unmanaged()
+        cpus = parse_cpu_list(CPU_AFFINITY) if CPU_AFFINITY else None
+        if cpus:
+            available = len(cpus)
+        elif hasattr(os, 'sched_getaffinity'):
+            available = len(os.sched_getaffinity(0))
+        else:
+            available = os.cpu_count() or 1
+        return cls(CPU_BUDGET or available, cpus, INFERENCE_THREADS, MEDIAPIPE_WORKERS, IMAGE_WORKERS)
+
+    # 須在 TensorFlow 執行任何運算前呼叫；綁定 CPU 只影響目前的執行緒與之後建立的執行緒，因此於模組載入時執行
+    def apply(self):
+        if not self.managed:
+            print(f"CPU 配置: 未套用 {self.describe()}")
+            return
+        if self.cpus:
+            os.sched_setaffinity(0, self.cpus)
+        tf.config.threading.set_intra_op_parallelism_threads(self.inference_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        cv2.setNumThreads(self.opencv_threads)
+        print(f"CPU 配置: {self.describe()}")
+
+    def describe(self):
+        return {
+            "managed": self.managed,
+            "cores": self.cores,
+            "cpus": self.cpus,
+            "inference_threads": self.inference_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "mediapipe_workers": self.mediapipe_workers,
+            "image_workers": self.image_workers,
+            "opencv_threads": self.opencv_threads,
+        }
+
+thread_budget = ThreadBudget.from_settings()
+thread_budget.apply()
 
 # 模型自訂層
 # XceptionLayer 
+# weights=None 時只建立架構，不下載/讀取 ImageNet 權重 (權重由模型檔覆蓋)
 class XceptionLayer(Layer):
-    def __init__(self, **kwargs):
+    def __init__(self, weights='imagenet', **kwargs):
         super(XceptionLayer, self).__init__(**kwargs)
-        self.xception = Xception(weights='imagenet', include_top=False)
+        self.xception_weights = weights
+        self.xception = Xception(weights=weights, include_top=False)
 
     def call(self, inputs, input_shape=(100, 100, 3)):
         return self.xception(inputs)
 
     def get_config(self):
         config = super().get_config()  
+        config.update({'weights': self.xception_weights})
         return config
 
+    # 載入已儲存的模型時權重皆由模型檔覆寫，不需下載 ImageNet 權重 (舊版模型檔的設定沒有 weights 欄位，會使用預設的 'imagenet')
+    @classmethod
+    def from_config(cls, config):
+        return cls(**dict(config, weights=None))
+
 # CBAMLayer 
 class CBAMLayer(Layer):
     def __init__(self, reduction_ratio=16, **kwargs):
@@ -61,25 +230,26 @@ class CBAMLayer(Layer):
         # 空间注意力
         self.spatial_conv = Conv2D(1, kernel_size=(7, 7), padding='same', activation='sigmoid')
 
+    # 只使用 build 中建立的子層與張量運算，不在每次呼叫時建立新的 Reshape/Lambda/Add/Multiply 層
     def call(self, inputs):
-        # 通道注意力
+        # 通道注意力 (與 Reshape((1, 1, -1)) 相同，保留靜態的通道數)
         channel_avg_pool = self.channel_avg_pool(inputs)
         channel_max_pool = self.channel_max_pool(inputs)
-        channel_avg_pool = Reshape((1, 1, -1))(channel_avg_pool)
-        channel_max_pool = Reshape((1, 1, -1))(channel_max_pool)
+        channel_avg_pool = tf.reshape(channel_avg_pool, (-1, 1, 1, int(np.prod(channel_avg_pool.shape[1:]))))
+        channel_max_pool = tf.reshape(channel_max_pool, (-1, 1, 1, int(np.prod(channel_max_pool.shape[1:]))))
         channel_avg_pool = self.channel_dense_1(channel_avg_pool)
         channel_max_pool = self.channel_dense_1(channel_max_pool)
         channel_avg_pool = self.channel_dense_2(channel_avg_pool)
         channel_max_pool = self.channel_dense_2(channel_max_pool)
-        channel_attention = Add()([channel_avg_pool, channel_max_pool])
-        channel_attention = Multiply()([inputs, channel_attention])
+        channel_attention = channel_avg_pool + channel_max_pool
+        channel_attention = inputs * channel_attention
 
         # 空间注意力
-        avg_pool = Lambda(lambda x: tf.reduce_mean(x, axis=-1, keepdims=True))(channel_attention)
-        max_pool = Lambda(lambda x: tf.reduce_max(x, axis=-1, keepdims=True))(channel_attention)
-        concat = Concatenate(axis=-1)([avg_pool, max_pool])
+        avg_pool = tf.reduce_mean(channel_attention, axis=-1, keepdims=True)
+        max_pool = tf.reduce_max(channel_attention, axis=-1, keepdims=True)
+        concat = tf.concat([avg_pool, max_pool], axis=-1)
         spatial_attention = self.spatial_conv(concat)
-        spatial_attention = Multiply()([channel_attention, spatial_attention])
+        spatial_attention = channel_attention * spatial_attention
 
         return spatial_attention
 
@@ -88,7 +258,359 @@ class CBAMLayer(Layer):
         config.update({'reduction_ratio': self.reduction_ratio})
         return config
     
-app = FastAPI()
+# 離線模型格式：目錄內含模型架構 (JSON) 與權重 (HDF5)
+OFFLINE_ARCHITECTURE_FILE = 'architecture.json'
+OFFLINE_WEIGHTS_FILE = 'weights.h5'
+CUSTOM_OBJECTS = {'XceptionLayer': XceptionLayer, 'CBAMLayer': CBAMLayer}
+
+def is_offline_model(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, OFFLINE_ARCHITECTURE_FILE))
+
+# 載入離線模型 (架構中的 XceptionLayer 已設為 weights=None，不需網路)
+def load_offline_model(path):
+    with open(os.path.join(path, OFFLINE_ARCHITECTURE_FILE), 'r', encoding='utf-8') as f:
+        model = tf.keras.models.model_from_json(f.read(), custom_objects=CUSTOM_OBJECTS)
+    model.load_weights(os.path.join(path, OFFLINE_WEIGHTS_FILE))
+    return model
+
+# 依路徑格式載入模型 (.keras 檔或離線模型目錄)
+def load_model_file(path):
+    if is_offline_model(path):
+        return load_offline_model(path)
+    return tf.keras.models.load_model(path, custom_objects=CUSTOM_OBJECTS)
+
+# 估計模型權重佔用的記憶體 (位元組)
+def estimate_model_bytes(model):
+    return sum(int(np.prod(w.shape)) * w.dtype.size for w in model.weights)
+
+# 模型輸入影像尺寸 (寬, 高)
+MODEL_INPUT_SIZE = (100, 100)
+
+# 建立固定輸入簽名的推論函數：輸入 uint8 BGR 影像批次，正規化在圖中以 float32 完成
+def make_inference_fn(model):
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None, MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3), dtype=tf.uint8)])
+    def infer(images):
+        return model(tf.cast(images, tf.float32) / 255.0, training=False)
+    return infer
+
+# 常駐模型：保存模型與預先追蹤的推論函數
+class ResidentModel:
+    def __init__(self, model):
+        self.model = model
+        self.infer = make_inference_fn(model)
+        self.size = estimate_model_bytes(model)
+
+    # 輸入 uint8 影像批次 (N, 100, 100, 3)，回傳各類別機率
+    def predict(self, images):
+        return self.infer(tf.convert_to_tensor(images, dtype=tf.uint8)).numpy()
+
+    # 先執行一次推論完成追蹤，避免第一個請求負擔追蹤時間
+    def warmup(self):
+        self.predict(np.zeros((1, MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3), np.uint8))
+
+def is_tflite_model(path):
+    return path.endswith('.tflite')
+
+# TFLite 常駐模型 (convert_tflite.py 轉換的 float16/int8 模型)，介面與 ResidentModel 相同
+# 模型輸入為單張 uint8 影像 (正規化在模型內完成)；CBAM 的 Dense 在動態批次下會產生執行時才決定形狀的張量，
+# 使 XNNPACK 無法套用，因此以固定批次 1 轉換，批次中的影像逐張推論 (XNNPACK 逐張與批次推論的單張耗時相近)
+# 直譯器不可並行呼叫，以鎖保護
+class TFLiteModel:
+    def __init__(self, path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads or thread_budget.inference_threads)  # 預設套用 XNNPACK
+        self.interpreter.allocate_tensors()
+        self.size = os.path.getsize(path)
+        self._input = self.interpreter.get_input_details()[0]['index']
+        self._output = self.interpreter.get_output_details()[0]['index']
+        self._lock = threading.Lock()
+
+    def predict(self, images):
+        images = np.asarray(images, np.uint8)
+        with self._lock:
+            outputs = []
+            for i in range(len(images)):
+                self.interpreter.set_tensor(self._input, images[i:i + 1])
+                self.interpreter.invoke()
+                outputs.append(self.interpreter.get_tensor(self._output))
+        return np.concatenate(outputs)
+
+    def warmup(self):
+        self.predict(np.zeros((1, MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3), np.uint8))
+
+# 依路徑格式建立常駐模型 (.tflite 使用 TFLite 直譯器，其餘為 Keras 模型)
+def load_resident_model(path):
+    if is_tflite_model(path):
+        return TFLiteModel(path)
+    return ResidentModel(load_model_file(path))
+
+# 效能指標 (Prometheus 格式，於 /metrics 提供)
+# 請求只需更新直方圖與計數器，佇列深度等即時數值在抓取時才計算
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_SECONDS = Histogram('emotion_recognition_request_seconds', '請求總耗時 (秒)', buckets=STAGE_BUCKETS)
+REQUEST_STAGE_SECONDS = Histogram('emotion_recognition_stage_seconds', '請求各階段耗時 (秒)', ['stage'], buckets=STAGE_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge('emotion_recognition_in_flight_requests', '處理中的請求數')
+INFERENCE_BATCH_SECONDS = Histogram('inference_batch_seconds', '單一推論批次耗時 (秒)', ['model_label'], buckets=STAGE_BUCKETS)
+INFERENCE_QUEUE_DEPTH = Gauge('inference_queue_depth', '推論佇列中等待的請求數', ['model_label'])
+MODEL_LOADS = MetricCounter('model_loads_total', '模型載入次數', ['path'])
+TRACKING_FACE_MESHES = Gauge('tracking_face_meshes', '即時分析連線專屬的追蹤模式 FaceMesh 數量')
+CAMERA_FRAMES = MetricCounter('camera_frames_total', '即時分析處理的影格數 (reused 為沿用前一次結果)', ['result'])
+CAMERA_SAVED_SECONDS = MetricCounter('camera_saved_seconds_total', '沿用結果所省下的推論與繪製時間估計 (秒)')
+CAMERA_SESSIONS = Gauge('camera_sessions', '即時分析 WebSocket 連線數')
+CAMERA_DROPPED_FRAMES = MetricCounter('camera_dropped_frames_total', '處理不及時而捨棄的即時分析影格數')
+RESULT_CACHE_REQUESTS = MetricCounter('result_cache_requests_total', '結果快取查詢次數 (hit/miss/coalesced)', ['result'])
+RESULT_CACHE_BYTES = Gauge('result_cache_bytes', '結果快取總大小估計 (位元組)')
+IMAGE_STORE_BYTES = Gauge('image_store_bytes', '暫存結果圖像總大小 (位元組)')
+MODEL_LOAD_SECONDS = Histogram('model_load_seconds', '模型載入耗時 (秒)', buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+
+# 單一請求的分階段計時：每次 lap 記錄距上一次的耗時，並組成 Server-Timing 標頭
+class StageTimer:
+    def __init__(self):
+        self.start = self._last = time.perf_counter()
+        self.stages = []  # (階段名稱, 秒數)
+
+    def lap(self, name):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.stages.append((name, elapsed))
+        REQUEST_STAGE_SECONDS.labels(name).observe(elapsed)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def header(self):
+        stages = self.stages + [("total", self.elapsed())]
+        return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages)
+
+# 模型常駐管理
+# 以模型檔實際路徑去除重複 (多個標籤可共用同一個模型檔)，超過記憶體預算時依 LRU 淘汰閒置模型
+class ModelRegistry:
+    def __init__(self, model_paths, memory_budget_mb):
+        self.model_paths = model_paths
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.load_count = 0
+        self._models = OrderedDict()  # 模型檔路徑 -> ResidentModel 或 TFLiteModel
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, label):
+        if label not in self.model_paths:
+            raise ValueError(f"Invalid model label: {label}")
+        return os.path.realpath(self.model_paths[label])
+
+    def _lookup(self, path):
+        with self._lock:
+            if path in self._models:
+                self._models.move_to_end(path)  # 標記為最近使用
+                return self._models[path]
+            self._load_locks.setdefault(path, threading.Lock())
+            return None
+
+    def get(self, label):
+        path = self.resolve(label)
+        model = self._lookup(path)
+        if model is not None:
+            return model
+
+        # 同一模型檔只由一個執行緒載入，其他請求等待載入完成後共用
+        with self._load_locks[path]:
+            model = self._lookup(path)
+            if model is not None:
+                return model
+            start = time.perf_counter()
+            model = load_resident_model(path)
+            model.warmup()
+            MODEL_LOAD_SECONDS.observe(time.perf_counter() - start)
+            MODEL_LOADS.labels(path).inc()
+            with self._lock:
+                self._models[path] = model
+                self.load_count += 1
+                self._evict(keep=path)
+            print(f"模型已載入: {path} ({model.size / 1024 / 1024:.1f} MB)")
+        return model
+
+    # 淘汰最久未使用的模型直到符合記憶體預算 (正在處理中的請求仍持有模型參照，不受影響)
+    def _evict(self, keep):
+        total = sum(model.size for model in self._models.values())
+        for path in list(self._models):
+            if total <= self.memory_budget:
+                break
+            if path == keep:
+                continue
+            total -= self._models.pop(path).size
+            print(f"模型已淘汰: {path}")
+
+    # 預先載入所有模型
+    def preload(self):
+        for label in self.model_paths:
+            try:
+                self.get(label)
+            except Exception as e:
+                print(f"模型預載失敗 {label}: {e}")
+
+model_registry = ModelRegistry(MODEL_PATHS, MODEL_MEMORY_BUDGET_MB)
+
+# MediaPipe、TensorFlow 與 OpenCV 的運算在各自的執行緒池中執行，避免阻塞事件迴圈
+mediapipe_executor = ThreadPoolExecutor(thread_budget.mediapipe_workers, thread_name_prefix='mediapipe')
+inference_executor = ThreadPoolExecutor(INFERENCE_WORKERS, thread_name_prefix='inference')
+image_executor = ThreadPoolExecutor(thread_budget.image_workers, thread_name_prefix='image')
+
+# 推論批次排程
+# 每個模型標籤一個佇列與背景工作，收集並行請求的影像後一次推論，再將各列結果分別回傳給請求者
+class InferenceBatcher:
+    def __init__(self, max_batch_size, max_wait_ms):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queues = {}
+        self._workers = {}
+
+        # 統計資訊
+        self.batch_sizes = Counter()  # 批次大小 -> 次數
+        self.request_count = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    # 輸入 uint8 影像批次 (N, 100, 100, 3)，回傳對應的 N 列預測結果
+    async def predict(self, label, images):
+        model_registry.resolve(label)  # 無效的標籤直接拋出 ValueError
+        if label not in self._queues:
+            self._queues[label] = asyncio.Queue()
+            self._workers[label] = asyncio.create_task(self._worker(label, self._queues[label]))
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[label].put((images, future, time.perf_counter()))
+        return await future
+
+    # 收集佇列中的請求直到批次上限或等待逾時
+    async def _collect(self, queue):
+        loop = asyncio.get_running_loop()
+        items = [await queue.get()]
+        count = len(items[0][0])
+        deadline = loop.time() + self.max_wait
+        while count < self.max_batch_size:
+            if queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = queue.get_nowait()
+            items.append(item)
+            count += len(item[0])
+        return items
+
+    async def _worker(self, label, queue):
+        loop = asyncio.get_running_loop()
+        # 合併批次用的緩衝區 (每個標籤一個，推論完成後才收集下一批，可重複使用)
+        batch_buffer = np.empty((self.max_batch_size, MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3), np.uint8)
+        while True:
+            items = await self._collect(queue)
+
+            started = time.perf_counter()
+            for _, _, enqueued in items:
+                wait = started - enqueued
+                self.queue_wait_total += wait
+                self.queue_wait_max = max(self.queue_wait_max, wait)
+            self.request_count += len(items)
+
+            try:
+                count = sum(len(images) for images, _, _ in items)
+                batch = batch_buffer[:count] if count <= len(batch_buffer) else np.empty((count,) + batch_buffer.shape[1:], np.uint8)
+                np.concatenate([images for images, _, _ in items], out=batch)
+                self.batch_sizes[len(batch)] += 1
+                predictions = await loop.run_in_executor(inference_executor, lambda: load_model_by_label(label).predict(batch))
+                INFERENCE_BATCH_SECONDS.labels(label).observe(time.perf_counter() - started)
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            # 依序切出每個請求的預測結果
+            offset = 0
+            for images, future, _ in items:
+                if not future.done():
+                    future.set_result(predictions[offset:offset + len(images)])
+                offset += len(images)
+
+    def queue_depths(self):
+        return {label: queue.qsize() for label, queue in self._queues.items()}
+
+    def stats(self):
+        batch_count = sum(self.batch_sizes.values())
+        image_count = sum(size * n for size, n in self.batch_sizes.items())
+        return {
+            "requests": self.request_count,
+            "batches": batch_count,
+            "mean_batch_size": round(image_count / batch_count, 2) if batch_count else 0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "mean_queue_wait_ms": round(self.queue_wait_total / self.request_count * 1000, 3) if self.request_count else 0,
+            "max_queue_wait_ms": round(self.queue_wait_max * 1000, 3),
+            "queue_depth": self.queue_depths(),
+        }
+
+    async def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._queues.clear()
+        self._workers.clear()
+
+inference_batcher = InferenceBatcher(INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS)
+
+# 伺服器啟動時預載模型與肌肉定義，關閉時停止推論排程與執行緒池
+@asynccontextmanager
+async def lifespan(app):
+    if PRELOAD_MODELS:
+        model_registry.preload()
+    muscle_definitions.get()
+    evictor = asyncio.create_task(evict_idle_face_meshes())
+    yield
+    evictor.cancel()
+    await inference_batcher.close()
+    for executor in (mediapipe_executor, inference_executor, image_executor):
+        executor.shutdown(wait=False)
+    face_mesh_pool.close()
+    multi_face_mesh_pool.close()
+    tracking_face_meshes.close()
+
+# 上傳大小限制中介層：先檢查 Content-Length，再於接收內容時累計位元組數，
+# 超過上限立即回傳 413，不必等待整個檔案上傳完成
+class UploadLimitMiddleware:
+    def __init__(self, app, max_bytes, paths):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({"detail": "Upload too large"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app = FastAPI(lifespan=lifespan)
+# 限制上傳大小 (在 CORS 中介層之內，413 回應同樣帶有 CORS 標頭)
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_MB * 1024 * 1024, paths={"/emotion_recognition"})
 # 添加 CORS 中间件
 app.add_middleware(
     CORSMiddleware,
@@ -96,90 +618,403 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["POST", "GET"],  # 添加GET方法
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],  # 讓網頁可讀取各階段耗時
 )
 
 # 處理從網頁收到的模型類別資訊
 def load_model_by_label(label):
-    if label in MODEL_PATHS:
-        return tf.keras.models.load_model(MODEL_PATHS[label], custom_objects={'XceptionLayer': XceptionLayer, 'CBAMLayer': CBAMLayer})
-    else:
-        raise ValueError(f"Invalid model label: {label}")
+    return model_registry.get(label)
 
 # 初始化MediaPipe
 mp_face_detection = mp.solutions.face_detection
 mp_drawing = mp.solutions.drawing_utils
 mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(static_image_mode=True, refine_landmarks=True, max_num_faces=1, min_detection_confidence=0.5)
-
-# 定義全局變量 original_img (網頁傳送的原始影像)
-original_img = None
-
-# 定義特徵點連線顏色
-def connect_points(image, coordinates, color):
-    for i in range(len(coordinates) - 1):
-        cv2.line(image, coordinates[i], coordinates[i + 1], color, 2)
-
-def detect_face_landmarks(image, results, feature_points_keys):
-    # 從JSON檔讀取自訂肌肉範圍及占比
-    with open(json_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-
-    # 從JSON檔讀取肌肉視覺化標記顏色
-    mu_color_mapping = {mu["mu_no"]: mu["mu_color"] for mu in data["mu_to_na"]}
 
-    if results.multi_face_landmarks:
-        for feature_points_key in feature_points_keys:
-            # 創建列表用於儲存計算後座標
-            final_coordinates = []
-
-            # 检查是否存在特徵點資訊
-            if feature_points_key not in data:
-                print(f"No feature points found for key: {feature_points_key}")
-                continue  # 如果没有特徵點，則跳過
-
-            for item in data[feature_points_key]:
+def create_face_mesh():
+    return mp_face_mesh.FaceMesh(static_image_mode=True, refine_landmarks=True, max_num_faces=1, min_detection_confidence=0.5)
+
+# FaceMesh 實例池
+# 請求取出一個實例使用後歸還，實例在需要時才建立，最多建立 size 個
+class FaceMeshPool:
+    def __init__(self, size, factory=create_face_mesh):
+        self.size = size
+        self.factory = factory
+        self._pool = queue.LifoQueue()  # 優先重用最近使用的實例
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        try:
+            face_mesh = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    face_mesh = self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                face_mesh = self._pool.get()  # 所有實例皆在使用中，等待歸還
+        try:
+            yield face_mesh
+        finally:
+            self._pool.put(face_mesh)
+
+    def process(self, img):
+        with self.acquire() as face_mesh:
+            return face_mesh.process(img)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+face_mesh_pool = FaceMeshPool(thread_budget.mediapipe_workers)
+
+def create_multi_face_mesh():
+    return mp_face_mesh.FaceMesh(static_image_mode=True, refine_landmarks=True, max_num_faces=MAX_FACES_LIMIT, min_detection_confidence=0.5)
+
+# 多人臉分析使用的 FaceMesh 池 (與單人臉的實例分開，單人臉請求不需負擔多張臉的特徵點運算)
+multi_face_mesh_pool = FaceMeshPool(thread_budget.mediapipe_workers, create_multi_face_mesh)
+
+def create_tracking_face_mesh():
+    return mp_face_mesh.FaceMesh(static_image_mode=False, refine_landmarks=True, max_num_faces=1,
+                                 min_detection_confidence=0.5, min_tracking_confidence=0.5)
+
+# 連線專屬 FaceMesh 的狀態
+class TrackingFaceMesh:
+    __slots__ = ('face_mesh', 'last_used', 'in_use', 'released')
+
+    def __init__(self):
+        self.face_mesh = None  # 第一次處理影格時建立
+        self.last_used = time.monotonic()
+        self.in_use = True
+        self.released = False  # 使用中被釋放，待 process() 結束時關閉
+
+# 各連線專屬的追蹤模式 FaceMesh
+# 同一連線的影格依序處理，實例不會同時被多個執行緒使用；閒置超過 ttl 秒的實例由背景工作釋放
+class TrackingFaceMeshes:
+    def __init__(self, max_count, ttl, factory=create_tracking_face_mesh):
+        self.max_count = max_count
+        self.ttl = ttl
+        self.factory = factory
+        self._meshes = {}  # 連線編號 -> TrackingFaceMesh
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._meshes)
+
+    # 以連線專屬的實例處理影格，實例數已達上限時改用靜態模式的 FaceMesh 池
+    def process(self, session_id, img):
+        with self._lock:
+            entry = self._meshes.get(session_id)
+            if entry is None and len(self._meshes) < self.max_count:
+                entry = self._meshes[session_id] = TrackingFaceMesh()
+            elif entry is not None:
+                entry.in_use = True
+        if entry is None:
+            return face_mesh_pool.process(img)
+        try:
+            if entry.face_mesh is None:
+                entry.face_mesh = self.factory()
+            return entry.face_mesh.process(img)
+        except Exception:
+            self.release(session_id)
+            raise
+        finally:
+            with self._lock:
+                entry.last_used = time.monotonic()
+                entry.in_use = False
+                released = entry.released
+            if released and entry.face_mesh is not None:
+                entry.face_mesh.close()
+
+    # 自列表移除並回傳可立即關閉的實例 (須持有 _lock)
+    # 使用中的實例不可在 process() 執行途中關閉，只標記為待釋放，由 process() 結束時關閉
+    def _detach(self, session_ids):
+        face_meshes = []
+        for session_id in session_ids:
+            entry = self._meshes.pop(session_id)
+            if entry.in_use:
+                entry.released = True
+            elif entry.face_mesh is not None:
+                face_meshes.append(entry.face_mesh)
+        return face_meshes
+
+    def release(self, session_id):
+        with self._lock:
+            face_meshes = self._detach([session_id] if session_id in self._meshes else [])
+        for face_mesh in face_meshes:
+            face_mesh.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [session_id for session_id, entry in self._meshes.items()
+                    if not entry.in_use and now - entry.last_used > self.ttl]
+            face_meshes = self._detach(idle)
+        for face_mesh in face_meshes:
+            face_mesh.close()
+
+    def close(self):
+        with self._lock:
+            face_meshes = self._detach(list(self._meshes))
+        for face_mesh in face_meshes:
+            face_mesh.close()
+
+tracking_face_meshes = TrackingFaceMeshes(TRACKING_FACE_MESH_MAX, TRACKING_FACE_MESH_TTL)
+
+# 定期釋放閒置的追蹤模式 FaceMesh
+async def evict_idle_face_meshes():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(TRACKING_FACE_MESH_TTL / 2)
+        await loop.run_in_executor(mediapipe_executor, tracking_face_meshes.evict_idle)
+
+# 臉部網格特徵點數量 (refine_landmarks=True 時含虹膜共 478 點)
+NUM_FACE_LANDMARKS = 478
+
+# 兩眼外眼角的特徵點編號，其距離作為臉部尺度
+LEFT_EYE_OUTER = 33
+RIGHT_EYE_OUTER = 263
+
+# 面積差評估的參考眼距 (像素)
+# 面積差以眼距平方正規化後換算為此眼距下的像素面積，與輸入解析度無關，並沿用原本依像素面積訂定的等級門檻；
+# 網頁攝像頭 640x480 擷取的 480x480 畫面中，臉部對齊圓框時兩眼外眼角距離約為畫面寬度的 0.37
+REFERENCE_INTEROCULAR_PX = 176
+
+# 兩眼外眼角距離 (像素)
+def interocular_distance(points):
+    return float(np.linalg.norm(points[LEFT_EYE_OUTER] - points[RIGHT_EYE_OUTER]))
+
+# 肌肉定位點編譯結果
+# 將 JSON 中各部位項目的 "p" (比例) 與 "v" (特徵點編號) 編譯為稀疏權重矩陣 (CSR 格式，頂點數 × 478)，
+# 並記錄各部位在頂點中的範圍，一張臉所有部位的多邊形頂點只需一次稀疏矩陣乘法即可求得
+class MuscleGeometry:
+    def __init__(self, data):
+        indptr = [0]
+        indices = []
+        weights = []
+        self.offsets = {}  # 部位 -> (起始頂點, 結束頂點)
+
+        for key, items in data.items():
+            if not isinstance(items, list):
+                continue
+            start = len(indptr) - 1
+            for item in items:
+                if not isinstance(item, dict) or ("p" not in item and "v" not in item):
+                    continue
                 # 确保包含比例和特徵點編號
                 if "p" not in item or "v" not in item:
                     print(f"Missing data for item: {item}")
-                    continue  # 如果數據不完整，則跳過
-
-                scale_factors = [float(factor) for factor in item["p"].split()]  # 比例列表
-                feature_point_indices = [int(idx) for idx in item["v"].split()]  # 特徵點編號列表
-
-                # 初始化變數
-                summed_x = 0
-                summed_y = 0
-                summed_z = 0
-
-                # 指定的特徵點之座標*比例後計算出所需座標
-                for idx, factor in zip(feature_point_indices, scale_factors):
-                    # 确保索引在有效範圍
-                    if idx < len(results.multi_face_landmarks[0].landmark):
-                        landmark = results.multi_face_landmarks[0].landmark[idx]
-                        x, y, z = landmark.x, landmark.y, landmark.z
-                        x_image = int(x * image.shape[1] * factor)  #  x * 比例
-                        y_image = int(y * image.shape[0] * factor)  #  y * 比例
-                        z_image = int(z * factor)  # z * 比例
-                        summed_x += x_image
-                        summed_y += y_image
-                        summed_z += z_image
-
-                # 儲存計算後座標
-                if summed_x != 0 and summed_y != 0:  # 确保坐标有效
-                    final_coordinates.append((summed_x, summed_y))
-
-            # 使列表中的最后特徵點與第一特徵點連接
-            if final_coordinates:
-                final_coordinates.append(final_coordinates[0])
-
-                # 根據json檔獲取肌肉標記色彩，否則默認標記白色
-                color = mu_color_mapping.get(feature_points_key, "#ffffff") 
-
-                # 转换颜色格式（B, G, R）
-                color_tuple = tuple(int(color[i:i+2], 16) for i in (1, 3, 5))[::-1]
-
-                # 调用连线函数
-                connect_points(image, final_coordinates, color_tuple)
+                    continue
+                # 指定的特徵點之比例，略過超出範圍的特徵點
+                terms = [(int(idx), float(factor)) for idx, factor in zip(str(item["v"]).split(), str(item["p"]).split())
+                         if int(idx) < NUM_FACE_LANDMARKS]
+                if not terms:
+                    continue
+                indices.extend(idx for idx, _ in terms)
+                weights.extend(factor for _, factor in terms)
+                indptr.append(len(indices))
+            self.offsets[key] = (start, len(indptr) - 1)
+
+        self.indptr = np.array(indptr, np.int64)
+        self.indices = np.array(indices, np.int64)
+        self.weights = np.array(weights, np.float64)
+        self.vertex_count = len(indptr) - 1
+
+    # 以特徵點像素座標 (478, 2) 計算所有頂點座標 (頂點數, 2)
+    def project(self, points):
+        if self.vertex_count == 0:
+            return np.zeros((0, 2), np.float64)
+        terms = points[self.indices] * self.weights[:, None]
+        return np.add.reduceat(terms, self.indptr[:-1], axis=0)
+
+    # 取出指定部位的多邊形頂點，略過座標為 0 的無效頂點
+    def polygon(self, vertices, key):
+        start, stop = self.offsets[key]
+        polygon = vertices[start:stop]
+        return polygon[(polygon[:, 0] != 0) & (polygon[:, 1] != 0)]
+
+# 將 "#rrggbb" 色碼轉換為 OpenCV 的 (B, G, R)，無法解析時使用白色
+def hex_to_bgr(color):
+    try:
+        return tuple(int(color[i:i+2], 16) for i in (1, 3, 5))[::-1]
+    except (TypeError, ValueError):
+        return (255, 255, 255)
+
+# 表情類別查詢結果：表情名稱、牽動的肌肉編號、名稱與顏色
+class ExpressionInfo:
+    def __init__(self, emotion, mu_list, mu_names, mu_colors):
+        self.emotion = emotion
+        self.mu_list = mu_list
+        self.mu_names = mu_names
+        self.mu_colors = mu_colors
+        self.mu_result = ', '.join(mu_names)
+        self.mu_color_result = ', '.join(mu_colors)
+
+# 建立表情類別 -> AU -> 肌肉的查詢表 (以類別編號字串為鍵)
+def build_expression_index(data):
+    # 同一 AU 可能有多筆肌肉對應，依序全部納入
+    au_to_mu = {}
+    for au_data in data['au_to_mu']:
+        au_to_mu.setdefault(au_data['au_no'], []).extend(au_data['mu_no'].split())
+
+    # 同一肌肉編號以第一筆名稱資料為準
+    mu_to_na = {}
+    for mu_data in data['mu_to_na']:
+        mu_to_na.setdefault(mu_data['mu_no'], mu_data)
+
+    expressions = {}
+    for exp in data['exp_to_au']:
+        key = str(exp.get('exp_num'))
+        if key in expressions:
+            continue
+        mu_list = []
+        for au in exp.get('au_no', '').split():
+            mu_list.extend(au_to_mu.get(au, []))
+        named = [mu_to_na[mu] for mu in mu_list if mu in mu_to_na]
+        expressions[key] = ExpressionInfo(exp.get('exp', '未知表情'), mu_list,
+                                          [mu_data['mu_na'] for mu_data in named],
+                                          [mu_data['mu_color'] for mu_data in named])
+    return expressions
+
+# 肌肉定義快照：載入並編譯完成後才提供使用，之後不再變更
+class MuscleDefinitions:
+    def __init__(self, data, version, file_key):
+        self.data = data
+        self.version = version  # 每次重新載入遞增，供下游快取判斷是否失效
+        self.file_key = file_key
+        self.geometry = MuscleGeometry(data)
+        self.expressions = build_expression_index(data)
+        # 肌肉視覺化標記顏色 (B, G, R)
+        self.mu_bgr = {mu["mu_no"]: hex_to_bgr(mu["mu_color"]) for mu in data["mu_to_na"]}
+
+    # 依預測類別查詢表情資訊，查無對應時回傳 None
+    def expression(self, predicted_class):
+        return self.expressions.get(str(predicted_class))
+
+# 肌肉定義檔存放區
+# 只在檔案修改時間或大小改變時重新載入，新的快照完整建立後才替換，處理中的請求持續使用取得時的快照；
+# 若讀到寫入中的檔案 (JSON 解析失敗) 則沿用舊版本，下次檢查時再重試
+class MuscleDefinitionStore:
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self._current = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        current = self._current
+        if current is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return current
+        with self._lock:
+            if self._current is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._current
+            self._checked_at = time.monotonic()
+            try:
+                self._reload_if_changed()
+            except (OSError, ValueError) as e:
+                if self._current is None:
+                    raise
+                print(f"肌肉定義檔重新載入失敗，沿用版本 {self._current.version}: {e}")
+            return self._current
+
+    def _reload_if_changed(self):
+        stat = os.stat(self.path)
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        if self._current is not None and self._current.file_key == file_key:
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        version = self._current.version + 1 if self._current is not None else 1
+        self._current = MuscleDefinitions(data, version, file_key)
+        print(f"肌肉定義檔已載入: {self.path} (版本 {version})")
+
+muscle_definitions = MuscleDefinitionStore(json_path, MUSCLE_DEFINITION_CHECK_INTERVAL)
+
+# 臉部網格特徵點序列化後的記錄格式 (每點: 訊息標頭 + x/y/z 三個 float 欄位，共 17 位元組)
+_LANDMARK_RECORD = np.dtype([('tag', 'u1'), ('size', 'u1'), ('x_tag', 'u1'), ('x', '<f4'),
+                             ('y_tag', 'u1'), ('y', '<f4'), ('z_tag', 'u1'), ('z', '<f4')])
+
+# 將一張臉的特徵點一次轉為連續的 (478, 3) float32 陣列 (正規化座標)，後續各階段皆使用此陣列
+# 直接解析序列化內容以避免逐點存取 protobuf 欄位，格式不符時 (例如含 visibility 欄位) 改為逐點讀取
+def landmarks_to_array(face_landmarks):
+    buffer = face_landmarks.SerializeToString()
+    if len(buffer) == len(face_landmarks.landmark) * _LANDMARK_RECORD.itemsize:
+        records = np.frombuffer(buffer, _LANDMARK_RECORD)
+        if ((records['tag'] == 0x0a) & (records['size'] == 15) & (records['x_tag'] == 0x0d)
+                & (records['y_tag'] == 0x15) & (records['z_tag'] == 0x1d)).all():
+            return np.stack([records['x'], records['y'], records['z']], axis=1)
+    return np.array([(landmark.x, landmark.y, landmark.z) for landmark in face_landmarks.landmark], np.float32)
+
+# 特徵點像素座標 (478, 2)
+def landmark_pixels(landmarks, image):
+    return landmarks[:, :2].astype(np.float64) * (image.shape[1], image.shape[0])
+
+# 偵測到的每張臉只換算一次像素座標，肌肉多邊形、面積差、裁切框與影格變化偵測皆共用此陣列
+def face_points(face_landmarks, image):
+    return landmark_pixels(landmarks_to_array(face_landmarks), image)
+
+# 定義特徵點連線顏色
+def connect_points(image, coordinates, color):
+    cv2.polylines(image, [np.asarray(coordinates, np.int32)], isClosed=True, color=color, thickness=2)
+
+# 將多邊形頂點轉為水平翻轉後畫面的整數座標列表 (與繪製後再以 cv2.flip 翻轉的圖像一致)
+def mirrored_points(points, width):
+    points = np.asarray(points, np.int32).reshape(-1, 2)
+    return np.stack([width - 1 - points[:, 0], points[:, 1]], axis=1).tolist()
+
+# 各執行緒重複使用的影像緩衝區 (依名稱保存，尺寸或型別改變時重新配置)
+_worker_buffers = threading.local()
+
+def worker_buffer(name, shape, dtype=np.uint8):
+    buffer = getattr(_worker_buffers, name, None)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = np.empty(shape, dtype)
+        setattr(_worker_buffers, name, buffer)
+    return buffer
+
+# 計算指定肌肉部位的多邊形頂點，回傳 [(部位, 頂點座標)]，略過未定義或沒有有效頂點的部位
+def muscle_polygons(points, feature_points_keys, definitions):
+    # 自訂肌肉範圍及占比
+    geometry = definitions.geometry
+
+    # 一次計算所有部位的頂點座標
+    vertices = geometry.project(points)
+
+    polygons = []
+    for feature_points_key in feature_points_keys:
+        # 检查是否存在特徵點資訊
+        if feature_points_key not in geometry.offsets:
+            print(f"No feature points found for key: {feature_points_key}")
+            continue  # 如果没有特徵點，則跳過
+
+        final_coordinates = geometry.polygon(vertices, feature_points_key)
+        if len(final_coordinates):
+            polygons.append((feature_points_key, final_coordinates))
+    return polygons
+
+# mirror=True 時 image 為已水平翻轉的圖像，頂點換算為翻轉後的座標再繪製
+def detect_face_landmarks(image, points, feature_points_keys, definitions, mirror=False):
+    for feature_points_key, final_coordinates in muscle_polygons(points, feature_points_keys, definitions):
+        # 根據json檔獲取肌肉標記色彩 (B, G, R)，否則默認標記白色
+        color_tuple = definitions.mu_bgr.get(feature_points_key, (255, 255, 255))
+        if mirror:
+            final_coordinates = mirrored_points(final_coordinates, image.shape[1])
+
+        # 调用连线函数 (首尾相連)
+        connect_points(image, final_coordinates, color_tuple)
 
     return image
 
@@ -187,12 +1022,12 @@ def detect_face_landmarks(image, results, feature_points_keys):
 def polygon_area(points):
     if len(points) < 3:
         return 0
-    x = np.array([p[0] for p in points])
-    y = np.array([p[1] for p in points])
+    points = np.asarray(points, np.float64)
+    x, y = points[:, 0], points[:, 1]
     return 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
 
-# 計算左右面積差異
-def calculate_area_difference(img, face_landmarks, json_data):
+# 計算左右面積差異 (不繪製圖像)，回傳左右部位多邊形與評估結果
+def measure_area_difference(points, definitions):
     # 指定正規化範圍
     min_area = 0  # 最小值
     max_area = 10  # 最大值
@@ -201,30 +1036,11 @@ def calculate_area_difference(img, face_landmarks, json_data):
     def normalize_area(area):
         return (area - min_area) / (max_area - min_area) if max_area > min_area else 0
 
-    image_height, image_width = img.shape[:2]
-    left_coords, right_coords = [], []
-
-    for region, coords in zip(['area_l', 'area_r'], [left_coords, right_coords]):
-        for item in json_data[region]:
-            if "p" not in item or "v" not in item:
-                continue
-
-            scale_factors = [float(factor) for factor in item["p"].split()]
-            feature_point_indices = [int(idx) for idx in item["v"].split()]
-
-            # 計算實際座標
-            summed_x, summed_y = 0, 0
-            for idx, factor in zip(feature_point_indices, scale_factors):
-                if idx < len(face_landmarks.landmark):
-                    landmark = face_landmarks.landmark[idx]
-                    x, y = landmark.x * image_width * factor, landmark.y * image_height * factor
-                    summed_x += x
-                    summed_y += y
-            if summed_x != 0 and summed_y != 0:
-                coords.append((summed_x, summed_y))
-
-        if coords:
-            coords.append(coords[0]) 
+    # 計算實際座標
+    geometry = definitions.geometry
+    vertices = geometry.project(points)
+    left_coords = geometry.polygon(vertices, 'area_l')
+    right_coords = geometry.polygon(vertices, 'area_r')
 
     # 計算指定部位面積
     left_area = polygon_area(left_coords)
@@ -233,24 +1049,10 @@ def calculate_area_difference(img, face_landmarks, json_data):
     # 計算面積差，保留小數精度
     area_difference = round(abs(left_area - right_area), 4)
 
-    # 面積差正規化
-    normalized_difference = normalize_area(area_difference)
-    
-    # 若正規化後的數值超過 300，進行調整 (作為bug的暫時處理，有時計算出的面積會突然很大，可能是輸入的圖象尺寸過大)
-    if normalized_difference > 300:
-        print(f"正規化面積超過 300，調整前: {normalized_difference}")
-        normalized_difference /= 10
-        print(f"調整後的正規化面積: {normalized_difference}")
-    
-    normalized_difference = round(normalized_difference, 4)
-
-    # 標記指定部位範圍
-    cv2.polylines(img, [np.array(left_coords, np.int32)], isClosed=True, color=(255, 0, 0), thickness=2)
-    cv2.polylines(img, [np.array(right_coords, np.int32)], isClosed=True, color=(0, 0, 255), thickness=2)
-
-    # 正確顯示正規化數值
-    print(f"面積差（未正規化）: {area_difference}")
-    print(f"面積差（正規化）: {normalized_difference}")
+    # 面積差以眼距平方正規化 (換算為參考眼距下的面積) 後再正規化，等級不受影像解析度影響
+    interocular = interocular_distance(points)
+    scale = (REFERENCE_INTEROCULAR_PX / interocular) ** 2 if interocular > 0 else 0
+    normalized_difference = round(normalize_area(area_difference * scale), 4)
 
     # 設定等級和對應結果
     if normalized_difference < 135:
@@ -266,106 +1068,544 @@ def calculate_area_difference(img, face_landmarks, json_data):
         level = "3"
         result = "重度不協調"
 
+    return left_coords, right_coords, result, level, area_difference, normalized_difference
+
+# 左右面積部位的標記顏色 (B, G, R)
+AREA_LEFT_COLOR = (255, 0, 0)
+AREA_RIGHT_COLOR = (0, 0, 255)
+
+# 計算左右面積差異，並於圖像上標記左右部位範圍 (mirror=True 時 img 為已水平翻轉的圖像)
+def calculate_area_difference(img, points, definitions, mirror=False):
+    left_coords, right_coords, result, level, area_difference, normalized_difference = measure_area_difference(points, definitions)
+
+    # 標記指定部位範圍
+    if mirror:
+        left_coords, right_coords = mirrored_points(left_coords, img.shape[1]), mirrored_points(right_coords, img.shape[1])
+    connect_points(img, left_coords, AREA_LEFT_COLOR)
+    connect_points(img, right_coords, AREA_RIGHT_COLOR)
+
+    # 正確顯示正規化數值
+    print(f"面積差（未正規化）: {area_difference}")
+    print(f"面積差（正規化）: {normalized_difference}")
+
     return img, result, level, area_difference, normalized_difference
 
 
-#收到圖像後的處理
-@app.post("/emotion_recognition")
-async def emotion_recognition(file: UploadFile = File(...), model_label: str = Form(...)):
-    global json_path  # 使用全局變量 json_path
+# 結果圖像暫存區
+# 以隨機編號保存已編碼的 JPEG，逾時或超過總大小上限時依存入順序淘汰
+class ImageStore:
+    def __init__(self, ttl, max_mb):
+        self.ttl = ttl
+        self.max_bytes = max_mb * 1024 * 1024
+        self.total_bytes = 0
+        self._images = OrderedDict()  # 編號 -> (到期時間, JPEG 內容)
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        image_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._images[image_id] = (time.monotonic() + self.ttl, data)
+            self.total_bytes += len(data)
+            self._evict()
+        return image_id
+
+    def get(self, image_id):
+        with self._lock:
+            item = self._images.get(image_id)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._images:
+            image_id, (expires, data) = next(iter(self._images.items()))
+            if expires >= now and self.total_bytes <= self.max_bytes:
+                break
+            del self._images[image_id]
+            self.total_bytes -= len(data)
+
+image_store = ImageStore(IMAGE_STORE_TTL, IMAGE_STORE_MAX_MB)
+
+# 分析結果快取 (LRU)
+# 只在事件迴圈中存取，不需要鎖；計算中的鍵記錄於 _inflight，相同的請求等待同一個 Future
+class ResultCache:
+    def __init__(self, max_mb):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # 鍵 -> (結果, 大小估計)
+        self._inflight = {}
+
+    async def get_or_compute(self, key, compute, timer):
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None and self._valid(entry[0]):
+                self._entries.move_to_end(key)
+                RESULT_CACHE_REQUESTS.labels("hit").inc()
+                timer.lap("cache_hit")
+                return entry[0]
+            if key not in self._inflight:
+                break
+            # 計算中的請求被取消時結果為 None，等待者重新查詢 (由其中一個等待者重新計算)
+            result = await asyncio.shield(self._inflight[key])
+            if result is not None:
+                RESULT_CACHE_REQUESTS.labels("coalesced").inc()
+                timer.lap("coalesced")
+                return result
+
+        RESULT_CACHE_REQUESTS.labels("miss").inc()
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.set_result(None)  # 不取消等待者，改由等待者重新計算
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 沒有其他等待者時避免出現未取得例外的警告
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(result)
+        self._put(key, result)
+        return result
+
+    # url 模式結果中的暫存圖像可能已逾時或被淘汰，此時視為未命中
+    @staticmethod
+    def _valid(result):
+        return all(image_store.get(value.rsplit('/', 1)[-1]) is not None
+                   for key, value in result.items() if key.endswith('_url'))
+
+    def _put(self, key, result):
+        size = sum(len(str(value)) for value in result.values())
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.total_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (result, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted
+
+result_cache = ResultCache(RESULT_CACHE_MAX_MB)
+
+# 依回應模式輸出結果圖像：base64 字串，或存入暫存區後回傳網址
+def encode_result_image(image, response_mode):
+    _, encoded = cv2.imencode('.jpg', image)
+    if response_mode == "url":
+        return f"/images/{image_store.put(encoded.tobytes())}"
+    return base64.b64encode(encoded).decode('utf-8')
+
+# 依影像標頭的尺寸選擇解碼模式：長邊為工作解析度 2/4/8 倍以上時以縮小模式解碼 (JPEG 於 DCT 階段即縮小)
+def decode_flags(contents):
     try:
-        model = load_model_by_label(model_label)
-    except ValueError as e:
-        return {"error": str(e)}
-        
-    contents = await file.read()
+        width, height = Image.open(io.BytesIO(contents)).size
+    except Image.DecompressionBombError:
+        raise ValueError("Image too large")  # 像素數超過 Pillow 的上限 (遠大於 MAX_IMAGE_PIXELS)
+    except (OSError, ValueError):
+        return cv2.IMREAD_COLOR  # 無法讀取標頭時交由 OpenCV 判斷
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Image too large: {width}x{height}")
+    for factor, flags in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) // factor >= WORKING_MAX_SIDE:
+            return flags
+    return cv2.IMREAD_COLOR
+
+# 解碼上傳影像 (縮放至工作解析度)，並縮放為模型輸入 (添加批次維度，正規化於推論函數中完成)
+def decode_image(contents):
+    if not contents:
+        raise ValueError("Empty image data")
     nparr = np.frombuffer(contents, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    original_img = img.copy()  # 備份原始圖像
-    
-    # 複製原始圖像供面積計算使用（不經過肌肉標記處理）
-    area_image_copy = original_img.copy()
+    img = cv2.imdecode(nparr, decode_flags(contents))
+    if img is None:
+        raise ValueError("Invalid image data")
+    longest = max(img.shape[:2])
+    if longest > WORKING_MAX_SIDE:
+        scale = WORKING_MAX_SIDE / longest
+        img = cv2.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    img_array = np.expand_dims(cv2.resize(img, MODEL_INPUT_SIZE), axis=0)
+    return img, img_array
+
+# 偵測臉部網格並轉為特徵點像素座標 (478, 2)，未偵測到人臉時回傳 None
+# 指定 session_id 時 (即時分析的連線) 使用該連線專屬的追蹤模式 FaceMesh
+def detect_landmarks(img, session_id=None):
+    if session_id is not None:
+        results = tracking_face_meshes.process(session_id, img)
+    else:
+        results = face_mesh_pool.process(img)
+    if not results.multi_face_landmarks:
+        return None
+    return face_points(results.multi_face_landmarks[0], img)
 
-    # 進行面部網格檢測
-    results = face_mesh.process(original_img)
-    
-    # 如果未偵測到任何人臉，返回訊息
+# 多人臉偵測：回傳最多 max_faces 張臉的特徵點像素座標列表，依翻轉後 (網頁顯示) 的畫面由左至右排序
+def detect_all_landmarks(img, max_faces):
+    results = multi_face_mesh_pool.process(img)
     if not results.multi_face_landmarks:
-        return {"result": "未偵測到人臉", "muresult": "", "area_result": ""}
+        return []
+    faces = [face_points(face_landmarks, img) for face_landmarks in results.multi_face_landmarks[:max_faces]]
+    return sorted(faces, key=lambda points: -float(np.mean(points[:, 0])))
+
+# 臉部裁切框 (x0, y0, x1, y1)：特徵點範圍外擴 FACE_CROP_MARGIN 後取正方形，並限制於影像範圍內
+def face_box(img, points):
+    (left, top), (right, bottom) = points.min(axis=0), points.max(axis=0)
+    center_x, center_y = (left + right) / 2, (top + bottom) / 2
+    half = max(right - left, bottom - top) * (1 + FACE_CROP_MARGIN) / 2
+    height, width = img.shape[:2]
+    x0, y0 = min(max(int(center_x - half), 0), width - 1), min(max(int(center_y - half), 0), height - 1)
+    x1, y1 = max(min(int(center_x + half) + 1, width), x0 + 1), max(min(int(center_y + half) + 1, height), y0 + 1)
+    return x0, y0, x1, y1
+
+# 裁切各臉部並縮放為模型輸入，合併為一個批次 (N, 100, 100, 3)
+def face_crops(img, boxes):
+    return np.stack([cv2.resize(img[y0:y1, x0:x1], MODEL_INPUT_SIZE) for x0, y0, x1, y1 in boxes])
+
+# 單張臉的文字結果 (表情、肌肉、面積評估)
+def face_summary(exp_info, area_result, level):
+    return {
+        "emotion_result": exp_info.emotion if exp_info else "未知表情",
+        "muresult": exp_info.mu_result if exp_info else "",
+        "mu_colors": exp_info.mu_color_result if exp_info else "",
+        "area_result": area_result,
+        "level": level,  # 包含等級
+    }
 
-    # 進行表情預測
-    img = cv2.resize(img, (100, 100))
-    img_array = np.expand_dims(img, axis=0)  # 添加批次維度
-    img_array = img_array / 255.0  # 正規化像素值
-    predictions = model.predict(img_array)
-    predicted_class = np.argmax(predictions)
-    
-    # 讀取 JSON 資料
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # 查詢表情對應的AU和MU 
-    exp_data = None
-    for exp in data['exp_to_au']:
-        if str(predicted_class) == str(exp.get('exp_num')):  # 對應表情代碼
-            exp_data = exp
-            break
-    
-    if exp_data:
-        emotion_result = exp_data.get('exp', '未知表情')
-        au_list = exp_data.get('au_no', '').split()
-        
-        mu_list = []
-        mu_names = []
-        mu_colors = []
-        for au in au_list:
-            for au_data in data['au_to_mu']:
-                if au_data['au_no'] == au:
-                    mus = au_data['mu_no'].split()
-                    mu_list.extend(mus)
-                    for mu in mus:
-                        for mu_data in data['mu_to_na']:
-                            if mu_data['mu_no'] == mu:
-                                mu_names.append(mu_data['mu_na'])
-                                mu_colors.append(mu_data['mu_color'])
-                                break
-        
-        # 使用查詢到的MU執行檢測
-        processed_image_for_muscles = detect_face_landmarks(original_img, results, mu_list)
-        mu_result = ', '.join(mu_names)
-        mu_color_result = ', '.join(mu_colors)
+# 依各臉部預測的表情標記肌肉、計算面積差異，並將結果圖像編碼
+# faces 為 [(特徵點像素座標, 預測類別)]，所有臉部標記於同一張肌肉圖像與面積圖像上，回傳 (結果圖像欄位, 各臉部結果)
+# 不另外配置整張圖像：img (本請求解碼的影像，之後只再使用其尺寸) 就地水平翻轉後直接作為肌肉標記圖像，
+# 面積圖像複製到執行緒重複使用的緩衝區，兩者皆以翻轉後的座標繪製
+def render_faces(img, faces, response_mode, definitions, timer):
+    cv2.flip(img, 1, dst=img)  # 水平翻轉 (網頁顯示為鏡像畫面)
+    area_image = worker_buffer('area_image', img.shape)
+    np.copyto(area_image, img)  # 面積計算圖像 (不經過肌肉標記處理)
+
+    results = []
+    for points, predicted_class in faces:
+        # 查詢表情對應的AU和MU，並使用查詢到的MU執行檢測
+        exp_info = definitions.expression(predicted_class)
+        if exp_info:
+            detect_face_landmarks(img, points, exp_info.mu_list, definitions, mirror=True)
+        _, area_result, level, _, _ = calculate_area_difference(area_image, points, definitions, mirror=True)
+        results.append(face_summary(exp_info, area_result, level))
+    timer.lap("render")
+
+    # 編碼為Base64格式 (url 模式改為回傳暫存圖像網址)
+    image_suffix = "_url" if response_mode == "url" else ""
+    images = {
+        "muscle_image" + image_suffix: encode_result_image(img, response_mode),  # 臉部肌肉位置的圖像
+        "area_image" + image_suffix: encode_result_image(area_image, response_mode),  # 面積計算後的圖像
+    }
+    timer.lap("encode")
+    return images, results
+
+# 單人臉的結果圖像與表情、肌肉、面積結果
+def render_analysis(img, points, predicted_class, response_mode, timer):
+    # 取得肌肉定義快照 (整個請求使用同一版本)
+    images, (result,) = render_faces(img, [(points, predicted_class)], response_mode, muscle_definitions.get(), timer)
+    return dict(images, **result)
+
+def bgr_to_hex(color):
+    return '#{:02x}{:02x}{:02x}'.format(*color[::-1])
+
+# 向量回應模式的單張臉結果：只計算肌肉與左右面積部位的多邊形，不複製、繪製或編碼圖像
+def face_vector_result(img, points, predicted_class, definitions):
+    width = img.shape[1]
+    exp_info = definitions.expression(predicted_class)
+
+    polygons = []
+    if exp_info:
+        for mu_no, coordinates in muscle_polygons(points, exp_info.mu_list, definitions):
+            polygons.append({"mu_no": mu_no, "color": bgr_to_hex(definitions.mu_bgr.get(mu_no, (255, 255, 255))),
+                             "points": mirrored_points(coordinates, width)})
+
+    left_coords, right_coords, area_result, level, _, _ = measure_area_difference(points, definitions)
+    return dict(face_summary(exp_info, area_result, level), muscle_polygons=polygons, area_polygons=[
+        {"side": "left", "color": bgr_to_hex(AREA_LEFT_COLOR), "points": mirrored_points(left_coords, width)},
+        {"side": "right", "color": bgr_to_hex(AREA_RIGHT_COLOR), "points": mirrored_points(right_coords, width)},
+    ])
+
+def vector_analysis(img, points, predicted_class, timer):
+    result = face_vector_result(img, points, predicted_class, muscle_definitions.get())
+    timer.lap("render")
+    result["image_size"] = [img.shape[1], img.shape[0]]  # 座標所對應的影像尺寸 (寬, 高)
+    return result
+
+# 多人臉的結果：各臉部的表情、肌肉與面積結果列於 faces (向量模式含各臉部多邊形，其他模式所有臉部標記於同一組結果圖像)
+def multi_face_analysis(img, faces, predicted_classes, response_mode, definitions, timer):
+    if response_mode == "vector":
+        results = [face_vector_result(img, points, predicted_class, definitions)
+                   for points, predicted_class in zip(faces, predicted_classes)]
+        timer.lap("render")
+        result = {}
     else:
-        emotion_result = "未知表情"
-        processed_image_for_muscles = original_img
-        mu_result = ""
-        mu_color_result = ""
-
-    # 使用先前複製的原始圖像進行面積計算
-    area_image, area_result, level, area_difference,normalized_difference = calculate_area_difference(area_image_copy, results.multi_face_landmarks[0], data)
+        result, results = render_faces(img, list(zip(faces, predicted_classes)), response_mode, definitions, timer)
+    result.update(image_size=[img.shape[1], img.shape[0]], face_count=len(results), faces=results)
+    return result
 
-    # 水平翻轉圖像
-    processed_image_for_muscles = cv2.flip(processed_image_for_muscles, 1)  # 水平翻轉肌肉標記圖像
-    area_image = cv2.flip(area_image, 1)  # 水平翻轉面積計算圖像
+# 結果快取鍵的影像內容部分：影像雜湊與目前的肌肉定義版本
+# 雜湊大型影像與檢查定義檔 (可能重新載入) 皆耗時，由執行緒池處理
+def content_key(contents):
+    return hashlib.sha256(contents).hexdigest(), muscle_definitions.get().version
 
-    # 把圖片編碼為Base64格式
-    _, encoded_image = cv2.imencode('.jpg', processed_image_for_muscles)
-    muscle_image_base64 = base64.b64encode(encoded_image).decode('utf-8')
+#收到圖像後的處理
+# 各階段的運算皆交由執行緒池處理，事件迴圈只負責 I/O 與排程
+# session 為即時分析的工作階段 (CameraSession)，使用其專屬的追蹤模式 FaceMesh 與影格變化偵測；
+# 上傳的影像 (無 session) 則經過結果快取，相同內容的影像不重複分析
+async def analyze_image(contents, model_label, response_mode, timer, session=None, max_faces=1):
+    try:
+        model_registry.resolve(model_label)
+    except ValueError as e:
+        return {"error": str(e)}
+    if response_mode not in RESPONSE_MODES:
+        return {"error": f"Invalid response mode: {response_mode}"}
+    if not isinstance(max_faces, int) or not 1 <= max_faces <= MAX_FACES_LIMIT:
+        return {"error": f"Invalid max_faces: {max_faces} (1-{MAX_FACES_LIMIT})"}
+
+    if session is not None:
+        return await run_pipeline(contents, model_label, response_mode, timer, session, max_faces)
+    digest, version = await asyncio.get_running_loop().run_in_executor(image_executor, content_key, contents)
+    key = (digest, model_label, response_mode, max_faces, version)
+    return await result_cache.get_or_compute(key, lambda: run_pipeline(contents, model_label, response_mode, timer, max_faces=max_faces), timer)
+
+async def run_pipeline(contents, model_label, response_mode, timer, session=None, max_faces=1):
+    loop = asyncio.get_running_loop()
+    try:
+        img, img_array = await loop.run_in_executor(image_executor, decode_image, contents)
+    except ValueError as e:
+        return {"error": str(e)}
+    timer.lap("decode")
 
-    _, encoded_area_image = cv2.imencode('.jpg', area_image)
-    area_image_base64 = base64.b64encode(encoded_area_image).decode('utf-8')
+    # 多人臉分析 (即時分析的連線同樣使用靜態影像模式的多人臉 FaceMesh，不沿用前一次結果)
+    if max_faces > 1:
+        return await run_multi_face_pipeline(img, model_label, response_mode, max_faces, timer)
 
-    # 返回最終結果
-    return {
-        "muscle_image": muscle_image_base64,  # 臉部肌肉位置的圖像
-        "emotion_result": emotion_result, 
-        "muresult": mu_result, 
-        "mu_colors": mu_color_result,
-        "area_image": area_image_base64,  # 面積計算後的圖像
-        "area_result": area_result,
-        "level": level  # 包含等級
-    }
+    # 進行面部網格檢測
+    points = await loop.run_in_executor(mediapipe_executor, detect_landmarks, img, session.session_id if session else None)
+    timer.lap("face_mesh")
+    
+    # 如果未偵測到任何人臉，返回訊息
+    if points is None:
+        return {"result": "未偵測到人臉", "muresult": "", "area_result": ""}
 
+    # 即時分析時臉部幾乎沒有移動，沿用前一次的結果
+    if session is not None:
+        result_key = (model_label, response_mode, muscle_definitions.get().version, img.shape)
+        result = session.change_detector.lookup(points, result_key)
+        if result is not None:
+            timer.lap("reuse")
+            return result
+    started = time.perf_counter()
+
+    # 進行表情預測 (含批次排程等待，模型尚未載入時另含載入時間)
+    predictions = await inference_batcher.predict(model_label, img_array)
+    predicted_class = np.argmax(predictions)
+    timer.lap("inference")
 
+    if response_mode == "vector":
+        result = await loop.run_in_executor(image_executor, vector_analysis, img, points, predicted_class, timer)
+    else:
+        result = await loop.run_in_executor(image_executor, render_analysis, img, points, predicted_class, response_mode, timer)
+
+    if session is not None:
+        session.change_detector.update(points, result_key, result, time.perf_counter() - started)
+    return result
+
+# 多人臉流程：一次偵測所有臉部，裁切後的臉部影像合併為一個批次推論，繪製與編碼也只進行一次，
+# 臉部數增加時只有特徵點運算與各臉部的幾何計算隨之增加
+async def run_multi_face_pipeline(img, model_label, response_mode, max_faces, timer):
+    loop = asyncio.get_running_loop()
+    faces = await loop.run_in_executor(mediapipe_executor, detect_all_landmarks, img, max_faces)
+    timer.lap("face_mesh")
+    if not faces:
+        return {"result": "未偵測到人臉", "muresult": "", "area_result": "", "face_count": 0, "faces": []}
+
+    boxes = [face_box(img, points) for points in faces]
+    crops = await loop.run_in_executor(image_executor, face_crops, img, boxes)
+    timer.lap("crop")
+
+    predictions = await inference_batcher.predict(model_label, crops)
+    predicted_classes = np.argmax(predictions, axis=1)
+    timer.lap("inference")
+
+    result = await loop.run_in_executor(image_executor, multi_face_analysis, img, faces, predicted_classes,
+                                        response_mode, muscle_definitions.get(), timer)
+    width = img.shape[1]
+    for face, (x0, y0, x1, y1), probabilities, predicted_class in zip(result["faces"], boxes, predictions, predicted_classes):
+        face["confidence"] = round(float(probabilities[predicted_class]), 4)
+        face["box"] = [width - x1, y0, x1 - x0, y1 - y0]  # 翻轉後畫面中的臉部範圍 (x, y, 寬, 高)
+    return result
+
+# 每個請求記錄各階段耗時，以 Server-Timing 標頭回傳並寫入 /metrics 的直方圖
+@app.post("/emotion_recognition")
+async def emotion_recognition(response: Response, file: UploadFile = File(...), model_label: str = Form(...),
+                              response_mode: str = Form("base64"), max_faces: int = Form(1)):
+    timer = StageTimer()
+    with REQUESTS_IN_FLIGHT.track_inprogress():
+        try:
+            contents = await file.read()
+            timer.lap("upload")
+            return await analyze_image(contents, model_label, response_mode, timer, max_faces=max_faces)
+        finally:
+            REQUEST_SECONDS.observe(timer.elapsed())
+            response.headers["Server-Timing"] = timer.header()
+
+# 影格變化偵測 (每個即時分析工作階段一個)
+# 比較新影格與上次分析影格的特徵點，位移低於門檻且結果未超過保留時間時回傳上次的結果
+class ChangeDetector:
+    def __init__(self, threshold, max_age):
+        self.threshold = threshold
+        self.max_age = max_age
+        self._points = None
+        self._key = None
+        self._result = None
+        self._cost = 0.0  # 產生上次結果所花費的秒數
+        self._analyzed_at = 0.0
+
+    # 特徵點平均位移，以兩眼外眼角距離正規化 (與影像解析度及臉部遠近無關)
+    @staticmethod
+    def motion(points, previous):
+        scale = interocular_distance(points)
+        if scale == 0:
+            return float('inf')
+        return float(np.mean(np.linalg.norm(points - previous, axis=1)) / scale)
+
+    def lookup(self, points, key):
+        if (self._result is None or key != self._key
+                or time.monotonic() - self._analyzed_at > self.max_age
+                or self.motion(points, self._points) >= self.threshold):
+            CAMERA_FRAMES.labels("analyzed").inc()
+            return None
+        CAMERA_FRAMES.labels("reused").inc()
+        CAMERA_SAVED_SECONDS.inc(self._cost)
+        return dict(self._result, reused=True)
+
+    def update(self, points, key, result, cost):
+        self._points = points
+        self._key = key
+        self._result = result
+        self._cost = cost
+        self._analyzed_at = time.monotonic()
+
+# 即時分析工作階段 (每個攝像頭 WebSocket 連線一個)
+# 接收端只保留最新一張尚未處理的影格，伺服器處理不及時直接以新影格取代舊影格，不累積佇列；
+# 處理端一次只處理一張影格，處理完成後將結果 (含影格編號與各階段耗時) 以 JSON 回傳
+class CameraSession:
+    def __init__(self, websocket, model_label, response_mode, max_faces):
+        self.websocket = websocket
+        self.session_id = secrets.token_hex(8)  # 對應連線專屬的追蹤模式 FaceMesh
+        self.change_detector = ChangeDetector(CHANGE_THRESHOLD, CHANGE_MAX_AGE)
+        self.model_label = model_label
+        self.response_mode = response_mode
+        self.max_faces = max_faces
+        self.frame = None  # (影格編號, JPEG 內容)
+        self.frame_count = 0
+        self.dropped = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    # 二進位訊息為影格，文字訊息為 JSON 物件形式的設定 (例如切換 model_label、max_faces)，其他內容略過
+    async def receive(self):
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    if self.frame is not None:
+                        self.dropped += 1
+                        CAMERA_DROPPED_FRAMES.inc()
+                    self.frame_count += 1
+                    self.frame = (self.frame_count, message["bytes"])
+                    self._ready.set()
+                elif message.get("text"):
+                    self.configure(message["text"])
+        finally:
+            self.closed = True
+            self._ready.set()
+
+    def configure(self, text):
+        try:
+            settings = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(settings, dict):
+            return
+        self.model_label = settings.get("model_label", self.model_label)
+        self.response_mode = settings.get("response_mode", self.response_mode)
+        self.max_faces = settings.get("max_faces", self.max_faces)
+
+    async def process(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if self.closed:
+                return
+            if self.frame is None:
+                continue
+            frame_id, contents = self.frame
+            self.frame = None
+
+            timer = StageTimer()
+            with REQUESTS_IN_FLIGHT.track_inprogress():
+                try:
+                    result = await analyze_image(contents, self.model_label, self.response_mode, timer, self, self.max_faces)
+                except Exception as e:
+                    result = {"error": f"Frame processing failed: {e}"}
+                REQUEST_SECONDS.observe(timer.elapsed())
+            await self.websocket.send_json({"frame_id": frame_id, "dropped": self.dropped,
+                                            "server_timing": timer.header(), **result})
+
+@app.websocket("/ws/emotion_recognition")
+async def emotion_recognition_ws(websocket: WebSocket, model_label: str = "Model_1", response_mode: str = "vector",
+                                 max_faces: int = 1):
+    await websocket.accept()
+    session = CameraSession(websocket, model_label, response_mode, max_faces)
+    receiver = asyncio.create_task(session.receive())
+    CAMERA_SESSIONS.inc()
+    try:
+        await session.process()
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # 傳送結果時連線已關閉
+    finally:
+        CAMERA_SESSIONS.dec()
+        receiver.cancel()
+        # 不等待釋放完成，連線工作被取消時仍會執行
+        mediapipe_executor.submit(tracking_face_meshes.release, session.session_id)
+        # 接收端因例外結束時記錄原因，並由伺服器端關閉連線 (否則用戶端收不到關閉訊息)
+        error = (await asyncio.gather(receiver, return_exceptions=True))[0]
+        if isinstance(error, Exception) and not isinstance(error, WebSocketDisconnect):
+            print(f"即時分析連線接收失敗: {error!r}")
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass  # 連線已由用戶端關閉
+
+
+
+# url 回應模式的結果圖像，逾時後回傳 404
+@app.get("/images/{image_id}")
+async def result_image(image_id: str):
+    data = image_store.get(image_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image not found or expired")
+    return Response(data, media_type="image/jpeg", headers={"Cache-Control": f"private, max-age={IMAGE_STORE_TTL}"})
+
+# 推論批次統計 (批次大小分布、佇列等待時間) 與此行程的 CPU 執行緒配置
+@app.get("/inference_stats")
+async def inference_stats():
+    return dict(inference_batcher.stats(), thread_budget=thread_budget.describe())
+
+# Prometheus 指標 (各階段耗時直方圖、處理中請求數、推論佇列深度、模型載入次數)
+@app.get("/metrics")
+async def metrics():
+    for label, depth in inference_batcher.queue_depths().items():
+        INFERENCE_QUEUE_DEPTH.labels(label).set(depth)
+    IMAGE_STORE_BYTES.set(image_store.total_bytes)
+    TRACKING_FACE_MESHES.set(len(tracking_face_meshes))
+    RESULT_CACHE_BYTES.set(result_cache.total_bytes)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 #主頁        
 @app.get("/web1", response_class=HTMLResponse)
@@ -783,7 +2023,8 @@ async def web2():
         }
 
         /* 空方框圖像設定 */
-        .box img {
+        .box img,
+        .box canvas {
             position: absolute;
             width: 100%;
             height: 100%;
@@ -1653,103 +2894,169 @@ async def web2():
                 isCameraConnected = false; // 攝像頭連接失敗
             });
 
-        // 監聽攝像頭頁面 "分析" 按鈕的點擊事件
+        // 監聽攝像頭頁面 "分析" 按鈕的點擊事件 (再按一次停止即時分析)
         document.getElementById('analyzeBtn-camera').addEventListener('click', () => {
             if (!isCameraConnected) {
                 alert('請先連接攝像頭！'); // 攝像頭未連接，顯示提示訊息
                 return; // 阻止事件繼續觸發
             }
-            captureAndSendImage(); // 攝像頭已連接，繼續進行分析
+            if (cameraSocket) {
+                stopCameraStream();
+            } else {
+                startCameraStream(); // 攝像頭已連接，開始即時分析
+            }
+        });
+
+        // 向量回應模式：將擷取的畫面水平翻轉後，繪製伺服器回傳的多邊形 (座標已對應翻轉後的畫面)
+        function drawVectorOverlay(container, frame, imageSize, polygons) {
+            const overlay = document.createElement('canvas');
+            overlay.width = imageSize[0];
+            overlay.height = imageSize[1];
+            const ctx = overlay.getContext('2d');
+            ctx.save();
+            ctx.translate(overlay.width, 0);
+            ctx.scale(-1, 1);
+            ctx.drawImage(frame, 0, 0, overlay.width, overlay.height);
+            ctx.restore();
+
+            ctx.lineWidth = 2;
+            polygons.forEach(polygon => {
+                ctx.strokeStyle = polygon.color;
+                ctx.beginPath();
+                polygon.points.forEach(([px, py], i) => i === 0 ? ctx.moveTo(px, py) : ctx.lineTo(px, py));
+                ctx.closePath();
+                ctx.stroke();
+            });
+            container.appendChild(overlay);
+        }
+
+        // 即時分析：以 WebSocket 連線持續傳送攝像頭影格，一次只有一張影格在處理中，收到結果後才擷取下一張
+        const wsUrl = "https://8638-210-59-96-137.ngrok-free.app".replace(/^http/, 'ws') + "/ws/emotion_recognition";
+        let cameraSocket = null;
+        let pendingFrame = null; // 已送出、等待結果的影格
+
+        function startCameraStream() {
+            const loadingElement = document.getElementById('loading'); // 取得 loading 元素
+            const selectedModelLabel = document.getElementById('modelSelect').value; // 獲取選擇的模型標籤
+            const socket = new WebSocket(wsUrl + "?model_label=" + encodeURIComponent(selectedModelLabel) + "&response_mode=vector");
+            socket.binaryType = 'arraybuffer';
+            cameraSocket = socket;
+
+            // 顯示 loading 動畫，直到收到第一個結果
+            loadingElement.style.display = 'flex';
+            document.getElementById('analyzeBtn-camera').textContent = '停止分析';
+
+            socket.onopen = () => sendCameraFrame(socket);
+            socket.onmessage = event => {
+                const data = JSON.parse(event.data);
+                loadingElement.style.display = 'none';
+                // 多人臉結果 (faces) 顯示第一張臉；未偵測到人臉時清除上一張影格的標記與結果
+                const face = data.faces ? data.faces[0] : data;
+                if (data.error) {
+                    console.error('Server error:', data.error);
+                } else if (face && face.emotion_result !== undefined) {
+                    showCameraResult(Object.assign({ image_size: data.image_size }, face), pendingFrame);
+                } else {
+                    clearCameraResult();
+                }
+                pendingFrame = null;
+                requestAnimationFrame(() => sendCameraFrame(socket)); // 收到結果後再送出下一張
+            };
+            socket.onclose = () => {
+                if (cameraSocket === socket) {
+                    stopCameraStream();
+                }
+            };
+            socket.onerror = error => console.error('WebSocket error:', error);
+        }
+
+        function stopCameraStream() {
+            const socket = cameraSocket;
+            cameraSocket = null;
+            pendingFrame = null;
+            if (socket && socket.readyState <= WebSocket.OPEN) {
+                socket.close();
+            }
+            document.getElementById('loading').style.display = 'none';
+            document.getElementById('analyzeBtn-camera').textContent = '開始分析';
+        }
+
+        // 切換模型時通知伺服器，之後的影格改用新模型
+        document.getElementById('modelSelect').addEventListener('change', event => {
+            if (cameraSocket && cameraSocket.readyState === WebSocket.OPEN) {
+                cameraSocket.send(JSON.stringify({ model_label: event.target.value }));
+            }
         });
 
-        // 將攝像頭影像發送到伺服器
-        function captureAndSendImage() {
+        // 擷取一張攝像頭影格並以 JPEG 二進位傳送
+        function sendCameraFrame(socket) {
+            if (socket !== cameraSocket || socket.readyState !== WebSocket.OPEN || pendingFrame) {
+                return;
+            }
             const video = document.getElementById('video');
             const canvas = document.createElement('canvas');
-            const loadingElement = document.getElementById('loading'); // 取得 loading 元素
             const size = Math.min(video.videoWidth, video.videoHeight); // 截取video的尺寸
             canvas.width = size;
             canvas.height = size;
             const ctx = canvas.getContext('2d');
             const x = (video.videoWidth - size) / 2; // 計算截取的起點坐標
             const y = (video.videoHeight - size) / 2;
+            ctx.drawImage(video, x, y, size, size, 0, 0, size, size); // 繪製截取的部分到video
 
-            // 顯示 loading 動畫
-            loadingElement.style.display = 'flex';
+            pendingFrame = canvas;
+            canvas.toBlob(blob => {
+                if (socket === cameraSocket && socket.readyState === WebSocket.OPEN) {
+                    socket.send(blob);
+                }
+            }, 'image/jpeg');
+        }
 
-            ctx.drawImage(video, x, y, size, size, 0, 0, size, size); // 繪製截取的部分到video
+        // 清除即時分析的標記與結果 (未偵測到人臉時)
+        function clearCameraResult() {
+            ['result-muimg', 'result-areaimg', 'emotion-container', 'mu-container', 'level-container', 'area-container']
+                .forEach(id => document.getElementById(id).innerHTML = '');
+        }
 
-            // 獲取選擇的模型標籤
-            const selectedModelLabel = document.getElementById('modelSelect').value;
+        // 顯示即時分析的結果
+        function showCameraResult(data, canvas) {
+            const ResultMuImg = document.getElementById('result-muimg');
+            ResultMuImg.innerHTML = '';
 
-            // 將圖像轉換為 Blob 物件
-            canvas.toBlob(blob => {
-                // 創建表單數據物件
-                const formData = new FormData();
-                formData.append('file', blob, 'captured_image.jpg'); // 圖像文件名，修改為 JPEG 格式
-                formData.append('model_label', selectedModelLabel);  // 發送模型標籤
-
-                // 發送 POST 請求
-                fetch("https://8638-210-59-96-137.ngrok-free.app/emotion_recognition", {
-                    method: 'POST',
-                    body: formData
-                })
-                    .then(response => response.json())
-                    .then(data => {
-                        const ResultMuImg = document.getElementById('result-muimg');
-                        ResultMuImg.innerHTML = '';
-
-                        const ResultAreaImg = document.getElementById('result-areaimg');
-                        ResultAreaImg.innerHTML = '';
-
-                        // 顯示臉部肌肉圖像
-                        if (data.muscle_image) {
-                            const muscleImgBase64 = data.muscle_image;
-                            const muscleImgElement = document.createElement('img');
-                            muscleImgElement.src = 'data:image/jpeg;base64,' + muscleImgBase64.replace(/"/g, '');
-                            ResultMuImg.appendChild(muscleImgElement);
-                        }
-
-                        // 顯示臉部區域面積圖像
-                        if (data.area_image) {
-                            const areaImgBase64 = data.area_image;
-                            const areaImgElement = document.createElement('img');
-                            areaImgElement.src = 'data:image/jpeg;base64,' + areaImgBase64.replace(/"/g, '');
-                            ResultAreaImg.appendChild(areaImgElement);
-                        }
-
-                        // 處理返回的辨識結果                    
-                        const emotion = data.emotion_result; // 獲取情緒類別的地方
-                        addEmotionMessages(emotion); // 調用 addEmotionMessages 函數
-
-                        const level = data.level;
-                        addlevelMessages(level);
-
-                        const area = data.area_result;
-                        addareaMessages(area);
-
-                        // 處理返回的肌肉名稱和顏色
-                        const muNames = data.muresult ? data.muresult.split(', ') : []; // 檢查 muresult 是否存在
-                        const muColors = data.mu_colors ? data.mu_colors.split(', ') : []; // 檢查 mu_colors 是否存在
-
-                        // 將名稱和顏色組合為對象，確保長度匹配
-                        const muscles = muNames.map((name, index) => ({
-                            name: name,
-                            color: muColors[index] || "#000000" // 如果顏色未定義，使用預設顏色
-                        }));
-
-                        // 傳遞肌肉數據到 addmuMessages 函數
-                        addmuMessages(muscles);
-
-                        // 隱藏 loading 動畫
-                        loadingElement.style.display = 'none';
-                    })
-                    .catch(error => {
-                        console.error('Error receiving image:', error);
-                        loadingElement.style.display = 'none'; // 發生錯誤時隱藏 loading 動畫
-                    });
-
-            }, 'image/jpeg'); // 修改圖像格式為 JPEG
+            const ResultAreaImg = document.getElementById('result-areaimg');
+            ResultAreaImg.innerHTML = '';
+
+            // 於擷取的畫面上繪製臉部肌肉範圍
+            if (data.muscle_polygons && canvas) {
+                drawVectorOverlay(ResultMuImg, canvas, data.image_size, data.muscle_polygons);
+            }
+
+            // 於擷取的畫面上繪製臉部區域面積範圍
+            if (data.area_polygons && canvas) {
+                drawVectorOverlay(ResultAreaImg, canvas, data.image_size, data.area_polygons);
+            }
+
+            // 處理返回的辨識結果                    
+            const emotion = data.emotion_result; // 獲取情緒類別的地方
+            addEmotionMessages(emotion); // 調用 addEmotionMessages 函數
+
+            const level = data.level;
+            addlevelMessages(level);
+
+            const area = data.area_result;
+            addareaMessages(area);
+
+            // 處理返回的肌肉名稱和顏色
+            const muNames = data.muresult ? data.muresult.split(', ') : []; // 檢查 muresult 是否存在
+            const muColors = data.mu_colors ? data.mu_colors.split(', ') : []; // 檢查 mu_colors 是否存在
+
+            // 將名稱和顏色組合為對象，確保長度匹配
+            const muscles = muNames.map((name, index) => ({
+                name: name,
+                color: muColors[index] || "#000000" // 如果顏色未定義，使用預設顏色
+            }));
+
+            // 傳遞肌肉數據到 addmuMessages 函數
+            addmuMessages(muscles);
         }
 
         // 監聽上傳頁面 "分析" 按鈕的點擊事件
@@ -1788,6 +3095,7 @@ async def web2():
                             const formData = new FormData();
                             formData.append('file', blob, 'uploaded_image.jpg');
                             formData.append('model_label', selectedModelLabel);
+                            formData.append('response_mode', 'url');  // 結果圖像以網址回傳，由瀏覽器直接下載二進位 JPEG
 
                             fetch("https://8638-210-59-96-137.ngrok-free.app/emotion_recognition", {
                                 method: 'POST',
@@ -1802,18 +3110,16 @@ async def web2():
                                     ResultAreaImg.innerHTML = '';
 
                                     // 顯示臉部肌肉圖像
-                                    if (data.muscle_image) {
-                                        const muscleImgBase64 = data.muscle_image;
+                                    if (data.muscle_image_url) {
                                         const muscleImgElement = document.createElement('img');
-                                        muscleImgElement.src = 'data:image/jpeg;base64,' + muscleImgBase64.replace(/"/g, '');
+                                        muscleImgElement.src = "https://8638-210-59-96-137.ngrok-free.app" + data.muscle_image_url;
                                         ResultMuImg.appendChild(muscleImgElement);
                                     }
 
                                     // 顯示臉部區域面積圖像
-                                    if (data.area_image) {
-                                        const areaImgBase64 = data.area_image;
+                                    if (data.area_image_url) {
                                         const areaImgElement = document.createElement('img');
-                                        areaImgElement.src = 'data:image/jpeg;base64,' + areaImgBase64.replace(/"/g, '');
+                                        areaImgElement.src = "https://8638-210-59-96-137.ngrok-free.app" + data.area_image_url;
                                         ResultAreaImg.appendChild(areaImgElement);
                                     }
 
@@ -1877,6 +3183,7 @@ async def web2():
 
         // 當按下關閉按鈕時，隱藏模型設定按鈕 & 上傳添加樣本 & 攝像頭添加頁面
         const handleCloseButtonClick = () => {
+            stopCameraStream();  // 停止即時分析
             ModelSettingsBtn.style.display = "none";  // 隱藏模型設定按鈕
             AddSampleCamera.style.display = "none";  // 隱藏攝像頭添加頁面
             AddSampleUpload.style.display = "none";  // 隱藏上傳添加樣本頁面
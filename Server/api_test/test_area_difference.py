@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+
+import ml_api
+from bench_pipeline import DEFAULT_AREA_POINTS, DEFAULT_DEFINITIONS, DEFAULT_IMAGE, load_definitions, load_image, synthetic_landmarks
+
+# 面積差以眼距正規化後，等級與數值不受影像解析度影響
+# 執行：python -m pytest test_area_difference.py (於 Server/api_test 目錄)
+
+SCALES = (0.25, 0.5, 2, 4)
+LEVEL_BOUNDARIES = (135, 150, 160)  # measure_area_difference 的等級門檻
+
+
+@pytest.fixture(scope='module')
+def definitions():
+    return load_definitions(DEFAULT_DEFINITIONS)
+
+@pytest.fixture(scope='module')
+def image():
+    return load_image(DEFAULT_IMAGE, 0)
+
+@pytest.fixture(scope='module')
+def face_points(image):
+    face_mesh = ml_api.create_face_mesh()
+    results = face_mesh.process(image)
+    face_mesh.close()
+    if results.multi_face_landmarks:
+        return ml_api.face_points(results.multi_face_landmarks[0], image)
+    return ml_api.landmark_pixels(synthetic_landmarks(), image)
+
+def side_areas(points, definitions):
+    vertices = definitions.geometry.project(points)
+    return [ml_api.polygon_area(definitions.geometry.polygon(vertices, key)) for key in ('area_l', 'area_r')]
+
+# 以右臉頰部位特徵點的重心放大右側面積，使正規化面積差恰為 target
+def with_normalized_difference(points, definitions, target):
+    left_area, right_area = side_areas(points, definitions)
+    scale = (ml_api.REFERENCE_INTEROCULAR_PX / ml_api.interocular_distance(points)) ** 2
+    factor = np.sqrt((left_area + target * 10 / scale) / right_area)
+    right = DEFAULT_AREA_POINTS['area_r']
+    points = points.copy()
+    center = points[right].mean(axis=0)
+    points[right] = center + (points[right] - center) * factor
+    return points
+
+
+# 等級門檻兩側 0.5 以內的輸入：縮放至 1/4 ~ 4 倍時數值差異須小於 0.01，等級不變
+@pytest.mark.parametrize('target', [boundary + offset for boundary in LEVEL_BOUNDARIES for offset in (-0.5, 0.5)])
+def test_normalized_difference_is_scale_invariant_near_level_boundary(face_points, definitions, target):
+    points = with_normalized_difference(face_points, definitions, target)
+    _, _, _, level, _, normalized_difference = ml_api.measure_area_difference(points, definitions)
+    assert normalized_difference == pytest.approx(target, abs=0.01)
+
+    for scale in SCALES:
+        _, _, _, scaled_level, _, scaled_difference = ml_api.measure_area_difference(points * scale, definitions)
+        assert scaled_level == level, scale
+        assert scaled_difference == pytest.approx(normalized_difference, abs=0.01), scale
+
+# 經伺服器解碼與臉部網格的完整流程：左右部位的正規化面積在各解析度下相差不超過 5%
+# (面積差為兩個相近面積之差，臉部網格在不同解析度下的特徵點抖動約 ±2%，不以面積差本身比較)
+def test_side_areas_are_resolution_independent(image, definitions):
+    face_mesh = ml_api.create_face_mesh()
+    normalized = {}
+    for scale in (1,) + SCALES:
+        scaled = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+        decoded = ml_api.decode_image(cv2.imencode('.png', scaled)[1].tobytes())[0]
+        results = face_mesh.process(decoded)
+        assert results.multi_face_landmarks, scale
+        points = ml_api.face_points(results.multi_face_landmarks[0], decoded)
+        factor = (ml_api.REFERENCE_INTEROCULAR_PX / ml_api.interocular_distance(points)) ** 2
+        normalized[scale] = np.array(side_areas(points, definitions)) * factor
+    face_mesh.close()
+
+    for scale in SCALES:
+        np.testing.assert_allclose(normalized[scale], normalized[1], rtol=0.05, err_msg=f'scale {scale}')
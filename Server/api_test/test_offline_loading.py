@@ -0,0 +1,73 @@
+import json
+import os
+import zipfile
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from keras.src.utils import data_utils
+
+import ml_api
+
+# 未連網的主機載入模型時不可下載 ImageNet 權重 (權重由模型檔覆寫)
+# 執行：python -m pytest test_offline_loading.py (於 Server/api_test 目錄)
+
+
+@pytest.fixture
+def block_download(monkeypatch):
+    def get_file(*args, **kwargs):
+        raise AssertionError(f"嘗試下載: {kwargs.get('origin', args[1] if len(args) > 1 else args)}")
+    monkeypatch.setattr(data_utils, 'get_file', get_file)
+
+def build_model():
+    inputs = tf.keras.Input((ml_api.MODEL_INPUT_SIZE[1], ml_api.MODEL_INPUT_SIZE[0], 3))
+    x = ml_api.XceptionLayer(weights=None)(inputs)
+    x = ml_api.CBAMLayer()(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(7, activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs)
+
+# 舊版 .keras 檔的 XceptionLayer 設定沒有 weights 欄位 (加入 weights 參數前儲存)
+def strip_weights_entry(config):
+    if isinstance(config, dict):
+        if config.get('class_name') == 'XceptionLayer':
+            config['config'].pop('weights', None)
+        for value in config.values():
+            strip_weights_entry(value)
+    elif isinstance(config, list):
+        for value in config:
+            strip_weights_entry(value)
+
+@pytest.fixture(scope='module')
+def legacy_model(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('models')
+    model = build_model()
+    saved = str(directory / 'saved.keras')
+    model.save(saved)
+
+    legacy = str(directory / 'legacy.keras')
+    with zipfile.ZipFile(saved) as source, zipfile.ZipFile(legacy, 'w') as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == 'config.json':
+                config = json.loads(data)
+                strip_weights_entry(config)
+                data = json.dumps(config)
+            target.writestr(item, data)
+    sample = np.random.default_rng(0).integers(0, 256, (2, ml_api.MODEL_INPUT_SIZE[1], ml_api.MODEL_INPUT_SIZE[0], 3), np.uint8)
+    return legacy, sample, model.predict(sample / 255.0, verbose=0)
+
+
+def test_legacy_keras_model_loads_without_download(block_download, legacy_model):
+    path, sample, expected = legacy_model
+    model = ml_api.load_model_file(path)
+    np.testing.assert_allclose(model.predict(sample / 255.0, verbose=0), expected, atol=1e-5)
+
+def test_export_runs_without_download(block_download, legacy_model, tmp_path):
+    from export_model import export_model
+
+    path, sample, expected = legacy_model
+    output_dir = str(tmp_path / 'offline')
+    export_model(path, output_dir)
+    assert ml_api.is_offline_model(output_dir)
+    np.testing.assert_allclose(ml_api.load_model_file(output_dir).predict(sample / 255.0, verbose=0), expected, atol=1e-5)